@@ -2,6 +2,9 @@ import eel
 import logging
 from threading import Thread, Event
 import sys
+import time
+import atexit
+import os
 
 from input_manager import InputManager
 from vnc import VNC
@@ -10,25 +13,79 @@ import string
 import psutil
 import socket
 from chat import Chat
+from frame_protocol import frame_to_ui
+import mux
+from async_core import AsyncHost, AsyncClient
+from pipeline import LatestFrame
+from metrics import metrics
+from logging_util import setup_logging
+from recording import SessionRecorder
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="[%(asctime)s] [%(levelname)s] %(message)s",
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler("app.log", encoding="utf-8")
-    ]
-)
+# Ghi log qua hàng đợi trên thread riêng và giới hạn log lặp lại trên hot path (mỗi dòng code
+# tối đa LOG_RATE_LIMIT log mỗi LOG_RATE_INTERVAL giây); False => ghi đồng bộ như cũ
+ASYNC_LOGGING = True
+LOG_RATE_LIMIT = 5
+LOG_RATE_INTERVAL = 5.0
+
+if ASYNC_LOGGING:
+    setup_logging(logging.DEBUG, "app.log", rate=LOG_RATE_LIMIT, interval=LOG_RATE_INTERVAL)
+else:
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format="[%(asctime)s] [%(levelname)s] %(message)s",
+        handlers=[
+            logging.StreamHandler(sys.stdout),
+            logging.FileHandler("app.log", encoding="utf-8")
+        ]
+    )
+
+# Gộp video, input và chat vào một kết nối duy nhất trên MUX_PORT (host và client phải cùng bật)
+SINGLE_CONNECTION = False
+MUX_PORT = 7002
+# Preview màn hình trên UI host: nhỏ hơn và thưa hơn frame gửi cho client
+PREVIEW_RESOLUTION = (900, 450)
+PREVIEW_INTERVAL = 0.1
+# Ghi snapshot thống kê các stage ra file (JSON lines) mỗi STATS_INTERVAL giây; None => tắt
+STATS_FILE = None
+STATS_INTERVAL = 5.0
+# Host/client chạy trên asyncio core; chế độ SINGLE_CONNECTION vẫn dùng các thread accept cũ
+ASYNC_CORE = True
+# Thư mục ghi lại phiên host (file .vrec, xem recording.py); None => không ghi
+RECORD_DIR = None
+# Chỉ đẩy frame tiếp theo lên UI khi trình duyệt báo đã vẽ xong frame trước (frame_drawn);
+# quá thời gian này mà chưa có báo thì đẩy tiếp (VD: trang vừa tải lại, mất lời báo)
+UI_DRAW_TIMEOUT = 1.0
 
 status = 'None'
 connection = 'None'
-vnc = VNC()
+# Thời điểm đẩy frame đang chờ trình duyệt vẽ; None => trình duyệt rảnh
+ui_frame_pushed_at = None
+vnc = VNC(max_viewers=20)
 input_manager = InputManager()
 stop_thread = Event()
 chat_manager = Chat()
+async_host = AsyncHost(vnc, input_manager, chat_manager)
+async_client = AsyncClient(vnc, input_manager, chat_manager)
+input_manager.capture_area = vnc.capture_area
+input_manager.on_viewport = vnc.set_viewport
+latest_frame = LatestFrame()
+transmit_thread = None
+input_thread = None
+chat_thread = None
 
 vnc.disconnect_chat = chat_manager.disconnect_chat
 
+def new_recorder():
+    """Mỗi phiên remote ghi ra một file .vrec riêng trong RECORD_DIR"""
+    os.makedirs(RECORD_DIR, exist_ok=True)
+    path = os.path.join(RECORD_DIR, time.strftime('session-%Y%m%d-%H%M%S.vrec'))
+    return SessionRecorder(path, on_gap=vnc.tile_encoder.request_keyframe)
+
+if RECORD_DIR:
+    vnc.recorder_factory = new_recorder
+    # Thoát app giữa phiên: đẩy nốt phần đang chờ xuống đĩa
+    atexit.register(vnc.stop_recording)
+
 eel.init('web')
 
 @eel.expose
@@ -90,20 +147,40 @@ def host():
         status = 'host'
         stop_thread.clear()
         vnc.open_chat_window = open_chat_window
-        transmit_thread = Thread(target=vnc.transmit_loop, args=[stop_thread])
+        chat_manager.display_message=display_recveive_message
+        chat_manager.status = 'host'
+
+        if ASYNC_CORE and not SINGLE_CONNECTION:
+            if not async_host.start():
+                logging.error("Không khởi động được host")
+                status = 'None'
+                chat_manager.status = ''
+            return
+
+        listeners = {}
+        if SINGLE_CONNECTION:
+            # Input và chat được phục vụ riêng cho từng kết nối mux (mỗi viewer một kết nối)
+            mux_listener = mux.MuxListener(port=MUX_PORT, handlers={
+                mux.CHANNEL_INPUT: input_manager.serve_input,
+                mux.CHANNEL_CHAT: chat_manager.serve_chat,
+            })
+            listeners = mux_listener.listeners
+            mux_thread = Thread(target=mux_listener.serve, args=[stop_thread])
+            mux_thread.daemon = True
+            mux_thread.start()
+
+        transmit_thread = Thread(target=vnc.transmit_loop, args=[stop_thread, listeners.get(mux.CHANNEL_VIDEO)])
         transmit_thread.daemon = True
         transmit_thread.start()
 
-        input_thread = Thread(target=input_manager.receive_input, args=[stop_thread])
-        input_thread.daemon = True
-        input_thread.start()
+        if not SINGLE_CONNECTION:
+            input_thread = Thread(target=input_manager.receive_input, args=[stop_thread])
+            input_thread.daemon = True
+            input_thread.start()
 
-        chat_manager.display_message=display_recveive_message
-        chat_manager.status = 'host'
-
-        chat_thread = Thread(target=chat_manager.receive_chat, args=[stop_thread])
-        chat_thread.daemon = True
-        chat_thread.start()
+            chat_thread = Thread(target=chat_manager.receive_chat, args=[stop_thread, False])
+            chat_thread.daemon = True
+            chat_thread.start()
 
         stop_thread.clear()
 
@@ -111,9 +188,14 @@ def host():
     elif status == 'host':
         status = 'None'
         chat_manager.status = ''
+        if async_host.is_running():
+            async_host.stop()
+            chat_manager.disconnect_chat()
+            return
+
         logging.debug("Đang dừng host threads...")
         stop_thread.set()
-        print("Gửi sự kiện dừng: " + str(stop_thread.is_set()))
+        logging.debug(f"Gửi sự kiện dừng: {stop_thread.is_set()}")
         if input_thread and input_thread.is_alive():
             input_thread.join(timeout=0.3)
         if transmit_thread and transmit_thread.is_alive():
@@ -133,6 +215,12 @@ def stop_connect():
     global vnc
     global chat_manager
     status = 'None'
+    if async_client.is_running():
+        async_client.close()
+        chat_manager.status = ''
+        logging.info("Đã dừng kết nối đến host.")
+        return
+
     try:
         vnc.stop_receive()
     except Exception as e:
@@ -164,23 +252,39 @@ def connect(ip, requestPassword):
     chat_manager.ip = ip
 
     try:
-        result = vnc.start_receive(requestPassword)
+        if ASYNC_CORE and not SINGLE_CONNECTION:
+            if not async_client.connect(ip, requestPassword):
+                raise Exception
+            chat_manager.display_message=display_recveive_message
+            chat_manager.status = 'client'
+            start_receiver(async_client)
+            connection = 'active'
+            eel.show(f"connect.html?host={ip}")
+            logging.info(f"Đã kết nối thành công tới {ip}")
+            return True
+
+        channels = {}
+        if SINGLE_CONNECTION:
+            channels = mux.connect(ip, MUX_PORT).channels
+
+        result = vnc.start_receive(requestPassword, sock=channels.get(mux.CHANNEL_VIDEO))
         if not result:
             raise Exception
-        chat_manager.connect_chat()
-        chat_manager.display_message=display_recveive_message
-        chat_manager.status = 'client'
-
         input_manager.requestKey = vnc.requestPassword
         input_manager.requestNonce = vnc.requestNonce
         chat_manager.requestKey = vnc.requestPassword
         chat_manager.requestNonce = vnc.requestNonce
-        input_manager.connect_input()
+
+        chat_manager.connect_chat(sock=channels.get(mux.CHANNEL_CHAT))
+        chat_manager.display_message=display_recveive_message
+        chat_manager.status = 'client'
+        input_manager.connect_input(sock=channels.get(mux.CHANNEL_INPUT))
 
         chat_thread = Thread(target=chat_manager.receive_chat, args=[stop_thread, True])
         chat_thread.daemon = True
         chat_thread.start()
 
+        start_receiver(vnc)
         connection = 'active'
         eel.show(f"connect.html?host={ip}")
         logging.info(f"Đã kết nối thành công tới {ip}")
@@ -189,26 +293,89 @@ def connect(ip, requestPassword):
         logging.error(f"Lỗi khi kết nối tới {ip}: {e}")
         return False
 
+def receive_frames(source, frames):
+    """Thread nhận frame riêng: đọc mạng liên tục, vòng lặp chính chỉ hiển thị frame mới nhất"""
+    while True:
+        try:
+            screen = source.receive()
+        except Exception as e:
+            logging.error(f"Lỗi nhận frame: {e}")
+            screen = None
+        if screen is None:
+            frames.close()
+            return
+        frames.put(screen)
+
+def start_receiver(source):
+    global latest_frame
+    global ui_frame_pushed_at
+    latest_frame = LatestFrame()
+    ui_frame_pushed_at = None
+    receive_thread = Thread(target=receive_frames, args=[source, latest_frame])
+    receive_thread.daemon = True
+    receive_thread.start()
+
+@eel.expose
+def frame_drawn():
+    """connect.html gọi sau khi vẽ xong frame: trong lúc chờ, frame mới được gộp ở LatestFrame"""
+    global ui_frame_pushed_at
+    ui_frame_pushed_at = None
+
+@eel.expose
+def get_stats():
+    """Percentile thời gian (ms) và tốc độ của từng stage cho overlay thống kê"""
+    return metrics.snapshot()
+
+def input_args(data, event_type):
+    if event_type == 'keydown':
+        return {'keydown': data}
+    elif event_type == 'keyup':
+        return {'keyup': data}
+    elif event_type == 'mousemove':
+        return {'mouse_pos': data}
+    elif event_type == 'mousedown':
+        return {'mouse_pos': data['pos'], 'mouse_down': data['button']}
+    elif event_type == 'mouseup':
+        return {'mouse_pos': data['pos'], 'mouse_up': data['button']}
+    elif event_type == 'wheel':
+        return {'wheel': data['deltaY']}
+    return {}
+
 @eel.expose
 def transmit_input(data, event_type):
     try:
         if status == 'client':
-            if event_type == 'keydown':
-                input_manager.transmit_input(keydown=data)
-            elif event_type == 'keyup':
-                input_manager.transmit_input(keyup=data)
-            elif event_type == 'mousemove':
-                input_manager.transmit_input(mouse_pos=data)
-            elif event_type == 'mousedown':
-                input_manager.transmit_input(mouse_pos=data['pos'], mouse_down=data['button'])
-            elif event_type == 'mouseup':
-                input_manager.transmit_input(mouse_pos=data['pos'], mouse_up=data['button'])
-            elif event_type == 'wheel':
-                input_manager.transmit_input(wheel=data['deltaY'])
-        logging.debug(f"Đã gửi input: {event_type} - {data}")
+            input_manager.transmit_input(**input_args(data, event_type))
+        if event_type != 'mousemove':
+            logging.debug(f"Đã gửi input: {event_type} - {data}")
     except Exception as e:
         logging.error(f"Lỗi khi transmit input: {e}")
 
+@eel.expose
+def transmit_input_batch(batch):
+    """Gửi nhiều input event (VD: mouse move đang chờ + click) trong một message"""
+    try:
+        if status == 'client':
+            events = []
+            for data, event_type in batch:
+                events += input_manager.build_events(**input_args(data, event_type))
+            input_manager.transmit_events(events)
+        logging.debug(f"Đã gửi {len(batch)} input trong một message")
+    except Exception as e:
+        logging.error(f"Lỗi khi transmit input batch: {e}")
+
+@eel.expose
+def select_capture_area(monitor, box=None):
+    """Client chọn monitor của host (0 = tất cả) và tuỳ chọn vùng con [left, top, right, bottom] 0..1"""
+    if status == 'client':
+        input_manager.transmit_capture_area(int(monitor), box)
+
+@eel.expose
+def report_viewport(width, height, pixel_ratio=1.0):
+    """Client báo kích thước vùng hiển thị màn hình host (CSS pixel) và devicePixelRatio"""
+    if status == 'client':
+        input_manager.transmit_viewport(width, height, pixel_ratio)
+
 @eel.expose
 def send_chat_message(msg):
     try:
@@ -220,16 +387,33 @@ def send_chat_message(msg):
 eel.start('index.html', block=False, port=8080, size=(595, 200))
 logging.info("Ứng dụng Eel đã khởi động trên port 8080")
 
+if STATS_FILE:
+    metrics.start_dump(STATS_FILE, STATS_INTERVAL, Event())
+
+last_preview = 0
 while True:
     try:
         if status == 'host':
-            eel.updateScreen(vnc.image_serializer().decode())
+            if time.monotonic() - last_preview >= PREVIEW_INTERVAL:
+                last_preview = time.monotonic()
+                started = time.perf_counter()
+                preview = vnc.preview_serializer(PREVIEW_RESOLUTION)
+                if preview is not None:
+                    eel.updateScreen(preview.decode())
+                    metrics.record('preview', time.perf_counter() - started, len(preview))
         elif status == 'client' and connection == 'active':
-            screen = vnc.receive()
-            if screen is not None:
-                eel.updateScreen(screen)
-            else:
-                eel.closeWindow()
+            cursor = latest_frame.take_cursor()
+            if cursor is not None:
+                eel.updateCursor(cursor)
+            if ui_frame_pushed_at is None or time.monotonic() - ui_frame_pushed_at >= UI_DRAW_TIMEOUT:
+                screen = latest_frame.take()
+                if screen is not None:
+                    started = time.perf_counter()
+                    ui_frame_pushed_at = time.monotonic()
+                    eel.updateScreen(frame_to_ui(screen))
+                    metrics.record('ui_push', time.perf_counter() - started)
+                elif latest_frame.closed:
+                    eel.closeWindow()
         eel.sleep(.015)
     except Exception as e:
         logging.error(f"Lỗi vòng lặp chính: {e}")
\ No newline at end of file
@@ -0,0 +1,580 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from threading import Thread, Event
+import asyncio
+import json
+import queue
+import struct
+import time
+import logging
+import chacha20_util
+from broadcast import Viewer
+from frame_protocol import is_keyframe, is_cursor, unpack_frame
+from input_protocol import unpack_events, is_control
+from framing import MAX_MESSAGE_SIZE
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct('>I')
+
+
+class MessageReader:
+    """Đọc message có header độ dài từ StreamReader rồi giải mã vào một buffer dùng lại
+
+    readexactly() đã trả về một bản copy nên giải mã ghi thẳng sang buffer của kết nối,
+    không copy thêm sang bytearray. Như framing.FramedReader, view trả về chỉ hợp lệ tới
+    lần đọc tiếp theo; reuse=False cấp buffer mới cho message phải giữ qua thread khác.
+    Ném IncompleteReadError khi kết nối đóng.
+    """
+
+    def __init__(self, reader, session, reuse=True, initial_size=64 * 1024):
+        self.reader = reader
+        self.session = session
+        self.reuse = reuse
+        self.buffer = bytearray(initial_size if reuse else 0)
+
+    async def read(self):
+        """Message còn mã hoá (bytes)"""
+        (length,) = HEADER.unpack(await self.reader.readexactly(HEADER.size))
+        if length > MAX_MESSAGE_SIZE:
+            raise ValueError(f"Message quá lớn ({length} bytes)")
+        return await self.reader.readexactly(length)
+
+    def open(self, ciphertext):
+        length = len(ciphertext)
+        if not self.reuse:
+            return self.session.receiver.open_into(ciphertext, bytearray(length))
+        if length > len(self.buffer):
+            self.buffer = bytearray(max(length, 2 * len(self.buffer)))
+        return self.session.receiver.open_into(ciphertext, memoryview(self.buffer)[:length])
+
+    async def read_message(self):
+        return self.open(await self.read())
+
+
+class LatestImage:
+    """Slot một ảnh giữa stage capture và encode trên event loop (latest-frame-wins)"""
+
+    def __init__(self):
+        self.image = None
+        self.ready = asyncio.Event()
+        self.dropped = 0
+
+    def put(self, image):
+        if self.image is not None:
+            self.dropped += 1
+        self.image = image
+        self.ready.set()
+
+    async def get(self):
+        while self.image is None:
+            self.ready.clear()
+            await self.ready.wait()
+        image, self.image = self.image, None
+        return image
+
+
+class StreamSocket:
+    """Cho code đồng bộ (Chat, InputManager) ghi vào StreamWriter như một socket thường"""
+
+    def __init__(self, loop, writer):
+        self.loop = loop
+        self.writer = writer
+
+    def sendall(self, data):
+        # Buffer của seal() được dùng lại nên phải copy trước khi chuyển sang event loop
+        self.loop.call_soon_threadsafe(self.writer.write, bytes(data))
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.writer.close)
+
+
+class AsyncViewer(Viewer):
+    """Viewer trên event loop: chỉ được gọi từ thread của loop nên không cần khoá"""
+
+    def __init__(self, writer, addr, session, queue_size=3):
+        super().__init__(writer, addr, session, queue_size)
+        self.ready = asyncio.Event()
+
+    def enqueue(self, item):
+        if len(self.frames) >= self.queue_size:
+            return False
+        self.frames.append(item)
+        self.ready.set()
+        return True
+
+    def offer_cursor(self, data):
+        self.cursor = (data, time.perf_counter())
+        self.ready.set()
+
+    def clear(self):
+        count = len(self.frames)
+        self.frames.clear()
+        return count
+
+    async def next_message(self):
+        while self.cursor is None and not self.frames:
+            self.ready.clear()
+            await self.ready.wait()
+        if self.cursor is not None:
+            item, self.cursor = self.cursor, None
+            return item
+        return self.frames.popleft()
+
+    def close(self):
+        self.closed = True
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+
+
+class EventLoopThread:
+    """Event loop asyncio chạy trên một thread riêng, start/stop xác định"""
+
+    def __init__(self):
+        self.loop = None
+        self.thread = None
+        self.tasks = set()
+
+    def start_loop(self):
+        self.loop = asyncio.new_event_loop()
+        started = Event()
+
+        def run():
+            asyncio.set_event_loop(self.loop)
+            self.loop.call_soon(started.set)
+            self.loop.run_forever()
+            self.loop.close()
+
+        self.thread = Thread(target=run, daemon=True)
+        self.thread.start()
+        started.wait()
+
+    def is_running(self):
+        return self.loop is not None
+
+    def call(self, coro, timeout=None):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    @contextmanager
+    def track(self):
+        """Ghi nhận task hiện tại để shutdown có thể huỷ ngay, không phải chờ timeout"""
+        task = asyncio.current_task()
+        self.tasks.add(task)
+        try:
+            yield
+        finally:
+            self.tasks.discard(task)
+
+    async def cancel_tasks(self):
+        tasks = [task for task in self.tasks if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stop_loop(self):
+        if self.loop is None:
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop = None
+        self.thread = None
+
+
+class AsyncHost(EventLoopThread):
+    """Host VNC, input và chat trên một event loop: accept không polling, encode chạy trên executor"""
+
+    def __init__(self, vnc, input_manager, chat):
+        super().__init__()
+        self.vnc = vnc
+        self.input_manager = input_manager
+        self.chat = chat
+        self.servers = []
+        self.viewers = set()
+        self.frame_task = None
+        self.capture_executor = None
+        self.encode_executor = None
+
+    def start(self):
+        """Trả về khi cả ba server đã lắng nghe (True) hoặc bind lỗi (False)"""
+        # mss giữ handle theo thread nên capture luôn chạy trên cùng một worker
+        self.capture_executor = ThreadPoolExecutor(max_workers=1)
+        self.encode_executor = ThreadPoolExecutor(max_workers=1)
+        self.start_loop()
+        try:
+            self.call(self.open_servers())
+            logger.info("Async host đã khởi động")
+            return True
+        except Exception as e:
+            logger.error(f"Lỗi khởi động async host: {e}")
+            self.stop()
+            return False
+
+    async def open_servers(self):
+        for handler, ip, port in (
+            (self.handle_vnc, self.vnc.ip, self.vnc.port),
+            (self.handle_input, self.input_manager.ip, self.input_manager.port),
+            (self.handle_chat, self.chat.ip, self.chat.port),
+        ):
+            self.servers.append(await asyncio.start_server(handler, ip, port, reuse_address=True))
+
+    def stop(self):
+        if self.loop is not None:
+            self.call(self.shutdown())
+            self.stop_loop()
+        for executor in (self.capture_executor, self.encode_executor):
+            if executor:
+                executor.shutdown(wait=True)
+        self.capture_executor = None
+        self.encode_executor = None
+        logger.info("Async host đã dừng")
+
+    async def shutdown(self):
+        for server in self.servers:
+            server.close()
+        await self.cancel_tasks()
+        self.servers = []
+
+    # ---------------- VNC ----------------
+
+    async def authenticate(self, reader, writer):
+        salt = await reader.readexactly(chacha20_util.SALT_SIZE)
+        (length,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+        password = (await reader.readexactly(length)).decode('utf-8')
+        if password != self.vnc.password:
+            logger.warning("Mật khẩu không đúng")
+            writer.write(b"AUTH_FAILED")
+            return None
+        if len(self.viewers) >= self.vnc.max_viewers:
+            logger.warning(f"Đã đủ {self.vnc.max_viewers} viewer, từ chối client mới")
+            writer.write(b"AUTH_BUSY")
+            return None
+        writer.write(b"AUTH_SUCCESS " + self.vnc.nonce.encode('utf-8'))
+        return chacha20_util.CipherSession(self.vnc.password, self.vnc.nonce, salt, initiator=False)
+
+    async def handle_vnc(self, reader, writer):
+        addr = writer.get_extra_info('peername')
+        viewer = None
+        with self.track():
+            try:
+                session = await self.authenticate(reader, writer)
+                if session is None:
+                    return
+                logger.info(f"VNC client đã kết nối: {addr}")
+                viewer = AsyncViewer(writer, addr, session)
+                if not self.viewers:
+                    # Viewer đầu tiên => bắt đầu phiên mới
+                    if self.vnc.open_chat_window:
+                        self.vnc.open_chat_window(addr[0])
+                    self.vnc.tile_encoder.reset()
+                    self.vnc.bitrate.reset()
+                    self.viewers.add(viewer)
+                    self.frame_task = asyncio.create_task(self.produce_frames())
+                else:
+                    self.viewers.add(viewer)
+                    self.vnc.tile_encoder.request_keyframe()
+                await self.send_frames(viewer)
+            except (asyncio.IncompleteReadError, ConnectionError) as e:
+                logger.warning(f"Viewer {addr} ngắt kết nối: {e}")
+            except asyncio.CancelledError:
+                # Host đang dừng: kết thúc callback bình thường để asyncio không log traceback
+                pass
+            finally:
+                writer.close()
+                if viewer is not None:
+                    self.viewers.discard(viewer)
+                    logger.info(f"Viewer {addr} đã rời ({len(self.viewers)} viewer, bỏ {viewer.dropped} frame)")
+                    if not self.viewers:
+                        self.end_session()
+
+    def end_session(self):
+        if self.frame_task:
+            self.frame_task.cancel()
+            self.frame_task = None
+        if self.vnc.disconnect_chat:
+            self.vnc.disconnect_chat()
+
+    async def produce_frames(self):
+        with self.track():
+            # Recorder riêng của phiên: phiên kế tiếp mở file mới dù task này chưa kết thúc hẳn
+            recorder = self.vnc.open_recorder()
+            cursor_task = asyncio.ensure_future(self.cursor_loop(recorder)) if self.vnc.cursor_factory else None
+            try:
+                await self.capture_loop(recorder)
+            except asyncio.CancelledError:
+                pass
+            finally:
+                if cursor_task:
+                    cursor_task.cancel()
+                # close() chờ thread ghi nên chạy ngoài loop
+                if recorder:
+                    await asyncio.get_running_loop().run_in_executor(None, self.vnc.close_recorder, recorder)
+
+    async def cursor_loop(self, recorder=None):
+        """Gửi con trỏ chuột của host thành message riêng, song song với capture_loop"""
+        loop = asyncio.get_running_loop()
+        try:
+            tracker = await loop.run_in_executor(None, self.vnc.cursor_factory)
+        except Exception as e:
+            logger.warning(f"Không theo dõi được con trỏ chuột: {e}")
+            return
+        self.vnc.cursor_state = None
+        while self.viewers:
+            try:
+                data = await loop.run_in_executor(None, self.vnc.cursor_update, tracker, recorder)
+            except Exception as e:
+                logger.error(f"Lỗi đọc con trỏ chuột: {e}")
+                data = None
+            if data is not None:
+                for viewer in list(self.viewers):
+                    viewer.offer_cursor(data)
+            await asyncio.sleep(self.vnc.cursor_interval)
+
+    async def capture_loop(self, recorder=None):
+        """Stage capture theo nhịp fps; stage encode chạy song song và lấy ảnh mới nhất từ slot
+
+        Như FramePipeline: ảnh thô bị ghi đè khi encoder bận là vô hại, còn frame đã
+        encode thì không bỏ vì delta phụ thuộc frame trước.
+        """
+        loop = asyncio.get_running_loop()
+        images = LatestImage()
+        source = self.vnc.source_factory()
+        await loop.run_in_executor(self.capture_executor, source.__enter__)
+        encode_task = asyncio.ensure_future(self.encode_loop(images, recorder))
+        try:
+            while self.viewers:
+                started = loop.time()
+                try:
+                    image = await loop.run_in_executor(self.capture_executor, source.grab)
+                    if image is not None:
+                        images.put(image)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Lỗi capture: {e}")
+                delay = 1.0 / self.vnc.bitrate.fps - (loop.time() - started)
+                await asyncio.sleep(max(0, delay))
+        finally:
+            encode_task.cancel()
+            await asyncio.gather(encode_task, return_exceptions=True)
+            self.capture_executor.submit(source.__exit__, None, None, None)
+            if images.dropped:
+                logger.debug(f"Capture đã bỏ {images.dropped} ảnh thô do encoder bận")
+
+    async def encode_loop(self, images, recorder=None):
+        loop = asyncio.get_running_loop()
+        while True:
+            image = await images.get()
+            try:
+                data = await loop.run_in_executor(self.encode_executor, self.vnc.encode_frame, image, recorder)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Lỗi encode: {e}")
+                continue
+            if data is None:
+                continue
+
+            keyframe = is_keyframe(data)
+            need_keyframe = False
+            for viewer in list(self.viewers):
+                if not viewer.offer(data, keyframe):
+                    need_keyframe = True
+            if need_keyframe:
+                self.vnc.tile_encoder.request_keyframe()
+
+    async def send_frames(self, viewer):
+        writer = viewer.conn
+        while True:
+            data, queued_at = await viewer.next_message()
+            started = time.perf_counter()
+            metrics.record('queue', started - queued_at)
+            sealed = viewer.session.sender.seal(data)
+            encrypted = time.perf_counter()
+            metrics.record('encrypt', encrypted - started, len(data))
+            writer.write(sealed)
+            await writer.drain()
+            metrics.record('send', time.perf_counter() - encrypted, len(sealed))
+            if not is_cursor(data):
+                self.vnc.bitrate.report(len(data), time.perf_counter() - started, started - queued_at, source=viewer)
+
+    # ---------------- Input ----------------
+
+    async def handle_input(self, reader, writer):
+        addr = writer.get_extra_info('peername')
+        with self.track():
+            try:
+                salt = await reader.readexactly(chacha20_util.SALT_SIZE)
+                session = chacha20_util.CipherSession(self.input_manager.key, self.input_manager.nonce, salt, initiator=False)
+                logger.info(f"Input client đã kết nối: {addr}")
+                mouse_controller, keyboard_controller, width, height = self.input_manager.input_controllers()
+                messages = MessageReader(reader, session)
+                while True:
+                    raw_data = await messages.read_message()
+                    if is_control(raw_data):
+                        self.input_manager.handle_control(raw_data)
+                        continue
+                    events = unpack_events(raw_data)
+                    started = time.perf_counter()
+                    for event in events:
+                        self.input_manager.inject_event(event, mouse_controller, keyboard_controller, width, height)
+                    metrics.record('input_inject', time.perf_counter() - started, len(raw_data))
+            except (asyncio.IncompleteReadError, ConnectionError):
+                logger.info(f"Input client {addr} đã ngắt kết nối")
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                logger.error(f"Lỗi vòng lặp receive_input: {e}")
+            finally:
+                writer.close()
+
+    # ---------------- Chat ----------------
+
+    async def handle_chat(self, reader, writer):
+        addr = writer.get_extra_info('peername')
+        conn = None
+        with self.track():
+            try:
+                salt = await reader.readexactly(chacha20_util.SALT_SIZE)
+                session = chacha20_util.CipherSession(self.chat.key, self.chat.nonce, salt, initiator=False)
+                # Mỗi viewer một peer: chat của host gửi tới tất cả, viewer rời chỉ gỡ peer của mình
+                conn = StreamSocket(self.loop, writer)
+                self.chat.add_peer(conn, session)
+                logger.info(f"Chat client đã kết nối: {addr}")
+                await receive_chat(reader, session, self.chat)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                logger.info(f"Chat client {addr} đã ngắt kết nối")
+            except asyncio.CancelledError:
+                pass
+            finally:
+                if conn is not None:
+                    self.chat.remove_peer(conn)
+                writer.close()
+
+
+async def receive_chat(reader, session, chat):
+    messages = MessageReader(reader, session)
+    while True:
+        msg_data = json.loads(str(await messages.read_message(), 'utf-8'))
+        logger.debug(f"Đã nhận message: {msg_data}")
+        if chat.display_message:
+            chat.display_message(msg_data['msg'])
+
+
+class AsyncClient(EventLoopThread):
+    """Client kết nối VNC, input và chat trên một event loop
+
+    Frame nhận được đưa vào hàng đợi; receive() trả về frame kế tiếp hoặc None khi mất kết nối.
+    """
+
+    def __init__(self, vnc, input_manager, chat):
+        super().__init__()
+        self.vnc = vnc
+        self.input_manager = input_manager
+        self.chat = chat
+        self.frames = queue.Queue()
+        self.writers = []
+
+    def connect(self, ip, password, timeout=10):
+        self.frames = queue.Queue()
+        self.start_loop()
+        try:
+            if self.call(self.open(ip, password), timeout):
+                return True
+        except Exception as e:
+            logger.error(f"Lỗi kết nối async tới {ip}: {e}")
+        self.close()
+        return False
+
+    async def open_stream(self, ip, port):
+        reader, writer = await asyncio.open_connection(ip, port)
+        self.writers.append(writer)
+        return reader, writer
+
+    async def open(self, ip, password):
+        reader, writer = await self.open_stream(ip, self.vnc.port)
+        salt = chacha20_util.new_salt()
+        password_bytes = password.encode('utf-8')
+        writer.write(salt + HEADER.pack(len(password_bytes)) + password_bytes)
+        # "AUTH_SUCC", "AUTH_FAIL" và "AUTH_BUSY" đều dài 9 byte => đọc đúng phần phản hồi
+        result = await reader.readexactly(9)
+        if result != b"AUTH_SUCC":
+            logger.error("Host đã đủ số viewer" if result == b"AUTH_BUSY" else "Xác thực thất bại — mật khẩu sai")
+            return False
+        await reader.readexactly(len("ESS "))
+        nonce = (await reader.readexactly(16)).decode('utf-8')
+        self.vnc.requestPassword = password
+        self.vnc.requestNonce = nonce
+        self.vnc.session = chacha20_util.CipherSession(password, nonce, salt, initiator=True)
+        logger.info(f"VNC client đã kết nối tới host {ip}:{self.vnc.port}")
+
+        _, input_writer = await self.open_stream(ip, self.input_manager.port)
+        input_salt = chacha20_util.new_salt()
+        input_writer.write(input_salt)
+        self.input_manager.session = chacha20_util.CipherSession(password, nonce, input_salt, initiator=True)
+        self.input_manager.conn = StreamSocket(self.loop, input_writer)
+
+        chat_reader, chat_writer = await self.open_stream(ip, self.chat.port)
+        chat_salt = chacha20_util.new_salt()
+        chat_writer.write(chat_salt)
+        self.chat.session = chacha20_util.CipherSession(password, nonce, chat_salt, initiator=True)
+        self.chat.conn = StreamSocket(self.loop, chat_writer)
+
+        asyncio.create_task(self.receive_frames(reader))
+        asyncio.create_task(self.receive_chat(chat_reader))
+        return True
+
+    async def receive_frames(self, reader):
+        with self.track():
+            # Frame đi qua hàng đợi sang thread hiển thị nên mỗi message cần buffer riêng
+            messages = MessageReader(reader, self.vnc.session, reuse=False)
+            try:
+                while True:
+                    started = time.perf_counter()
+                    encrypted_data = await messages.read()
+                    # receive gồm cả thời gian chờ host gửi frame, như VNC.recv_msg
+                    received = time.perf_counter()
+                    metrics.record('receive', received - started, len(encrypted_data))
+                    data = messages.open(encrypted_data)
+                    started = time.perf_counter()
+                    metrics.record('decrypt', started - received, len(data))
+                    self.frames.put(unpack_frame(data))
+                    metrics.record('decode', time.perf_counter() - started, len(data))
+            except (asyncio.IncompleteReadError, ConnectionError):
+                logger.warning("Mất kết nối VNC")
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                logger.error(f"Lỗi receive VNC: {e}")
+            finally:
+                self.frames.put(None)
+
+    async def receive_chat(self, reader):
+        with self.track():
+            try:
+                await receive_chat(reader, self.chat.session, self.chat)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                logger.error("Mất kết nối chat")
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                logger.error(f"Lỗi vòng lặp receive_chat (client): {e}")
+
+    def receive(self):
+        return self.frames.get()
+
+    def close(self):
+        if self.loop is not None:
+            self.call(self.shutdown())
+            self.stop_loop()
+        self.input_manager.conn = None
+        self.chat.conn = None
+        logger.info("Đã đóng kết nối async tới host")
+
+    async def shutdown(self):
+        await self.cancel_tasks()
+        for writer in self.writers:
+            writer.close()
+        self.writers = []
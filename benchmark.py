@@ -0,0 +1,181 @@
+"""Benchmark pipeline frame không cần màn hình: nguồn frame -> encode -> mã hoá -> giải mã -> decode
+
+Ví dụ:
+    python benchmark.py
+    python benchmark.py --scenario scrolling --frames 120 --workers 4 --json result.json
+    python benchmark.py --recorded ./captures
+    python benchmark.py --verify --workers 8
+"""
+from PIL import Image, ImageChops
+from io import BytesIO
+import argparse
+import functools
+import json
+import os
+import sys
+import time
+import chacha20_util
+from frame_protocol import unpack_frame, is_keyframe, CODEC_COPY
+from frame_sources import StaticDesktop, ScrollingText, VideoPlayback, RecordedFrames
+from metrics import metrics
+from vnc import VNC
+
+SCENARIOS = {
+    'static': StaticDesktop,
+    'scrolling': ScrollingText,
+    'video': VideoPlayback,
+}
+
+KEY = 'k' * 32
+NONCE = 'n' * 16
+
+
+def decode_regions(frame):
+    """Giải nén ảnh của từng region như trình duyệt sẽ làm"""
+    for region in frame['regions']:
+        if region.codec == CODEC_COPY:
+            continue
+        Image.open(BytesIO(region.data)).load()
+
+
+def run_scenario(name, source, frames, workers, delta_encoding=True):
+    vnc = VNC(delta_encoding=delta_encoding, encode_workers=workers)
+    salt = chacha20_util.new_salt()
+    host = chacha20_util.CipherSession(KEY, NONCE, salt, initiator=False)
+    client = chacha20_util.CipherSession(KEY, NONCE, salt, initiator=True)
+
+    metrics.reset()
+    sent = 0
+    total_bytes = 0
+    # CPU theo stage: process_time tính mọi thread, gồm cả worker encode mà vòng lặp đang chờ
+    stage_cpu = {}
+
+    def record_cpu(stage, cpu_started):
+        stage_cpu[stage] = stage_cpu.get(stage, 0.0) + time.process_time() - cpu_started
+
+    with source:
+        started = time.perf_counter()
+        cpu_started = time.process_time()
+        for _ in range(frames):
+            stage, stage_cpu_started = time.perf_counter(), time.process_time()
+            image = source.grab()
+            metrics.record('capture', time.perf_counter() - stage)
+            record_cpu('capture', stage_cpu_started)
+
+            # resize và encode được VNC.encode_frame tự ghi wall time; CPU đo chung cho cả hai
+            stage_cpu_started = time.process_time()
+            data = vnc.encode_frame(image)
+            record_cpu('encode', stage_cpu_started)
+            if data is None:
+                continue
+
+            stage, stage_cpu_started = time.perf_counter(), time.process_time()
+            sealed = host.sender.seal(data)
+            metrics.record('encrypt', time.perf_counter() - stage, len(sealed))
+            record_cpu('encrypt', stage_cpu_started)
+
+            stage, stage_cpu_started = time.perf_counter(), time.process_time()
+            plaintext = client.decrypt(bytearray(sealed[chacha20_util.HEADER_SIZE:]))
+            metrics.record('decrypt', time.perf_counter() - stage, len(plaintext))
+            record_cpu('decrypt', stage_cpu_started)
+
+            stage, stage_cpu_started = time.perf_counter(), time.process_time()
+            frame = unpack_frame(plaintext)
+            decode_regions(frame)
+            metrics.record('decode', time.perf_counter() - stage, len(plaintext))
+            record_cpu('decode', stage_cpu_started)
+
+            sent += 1
+            total_bytes += len(sealed)
+        elapsed = time.perf_counter() - started
+        cpu = time.process_time() - cpu_started
+
+    # Cửa sổ thống kê = toàn bộ lượt chạy => rate của mỗi stage là số lần/giây trên cả kịch bản
+    metrics.window = elapsed
+    stages = metrics.snapshot()
+    metrics.window = 5.0
+    # Chia cho số frame (không phải số lần gọi) để cộng các stage ra xấp xỉ cpu_ms_per_frame
+    for stage, total in stage_cpu.items():
+        if stage in stages:
+            stages[stage]['cpu_ms_per_frame'] = round(total * 1000 / frames, 2)
+    return {
+        'scenario': name,
+        'frames': frames,
+        'sent': sent,
+        'fps': round(frames / elapsed, 1),
+        'cpu_ms_per_frame': round(cpu * 1000 / frames, 2),
+        'bytes_per_frame': int(total_bytes / frames),
+        'stages': stages,
+    }
+
+
+def delta_regions(data):
+    """Region của delta (kể cả copy-rect); keyframe chia dải theo số worker nên không so"""
+    if data is None or is_keyframe(data):
+        return None
+    return [(region.x, region.y, region.width, region.height, region.codec, bytes(region.data))
+            for region in unpack_frame(data)['regions']]
+
+
+def verify_parallel(name, make_source, frames, workers):
+    """Encode cùng một chuỗi frame với 1 worker và `workers` worker: ảnh sau scale phải trùng
+    từng pixel và các delta (kể cả box copy-rect) phải giống hệt"""
+    single, parallel = VNC(encode_workers=1), VNC(encode_workers=workers)
+    with make_source() as first, make_source() as second:
+        for number in range(frames):
+            expected = delta_regions(single.encode_frame(first.grab()))
+            actual = delta_regions(parallel.encode_frame(second.grab()))
+            scaled = ImageChops.difference(single.tile_encoder.previous, parallel.tile_encoder.previous).getbbox()
+            if expected != actual or scaled is not None:
+                print(f"{name}: frame {number} khác nhau giữa 1 và {workers} worker")
+                return False
+    print(f"{name}: {frames} frame giống hệt giữa 1 và {workers} worker")
+    return True
+
+
+def print_result(result):
+    print(f"\n== {result['scenario']}: {result['fps']} fps, {result['cpu_ms_per_frame']} ms CPU/frame, "
+          f"{result['bytes_per_frame']} bytes/frame ({result['sent']}/{result['frames']} frame được gửi)")
+    # p50/p95/max là wall time mỗi lần (gồm cả thời gian chờ worker); cpu/frame là CPU của cả
+    # process chia cho số frame, với encode gồm cả resize
+    print(f"{'stage':<10}{'wall p50':>9}{'wall p95':>9}{'wall max':>9}{'cpu/frame':>10}{'count':>8}{'bytes':>12}")
+    for stage, stats in result['stages'].items():
+        print(f"{stage:<10}{stats['p50']:>9}{stats['p95']:>9}{stats['max']:>9}{stats.get('cpu_ms_per_frame', '-'):>10}"
+              f"{stats['count']:>8}{stats['bytes']:>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pipeline frame VNC không cần màn hình")
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), action='append',
+                        help="kịch bản tổng hợp cần chạy (mặc định: tất cả)")
+    parser.add_argument('--recorded', help="thư mục ảnh chụp màn hình để phát lại như một kịch bản")
+    parser.add_argument('--frames', type=int, default=60)
+    parser.add_argument('--size', type=int, nargs=2, default=(1920, 1080), metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--workers', type=int, default=min(8, os.cpu_count() or 1))
+    parser.add_argument('--no-delta', action='store_true', help="mọi frame đều là keyframe")
+    parser.add_argument('--json', help="ghi kết quả ra file JSON để so sánh giữa các lần chạy")
+    parser.add_argument('--verify', action='store_true',
+                        help="chỉ kiểm tra encode song song cho kết quả giống hệt encode 1 worker")
+    args = parser.parse_args()
+
+    runs = [(name, functools.partial(SCENARIOS[name], size=tuple(args.size))) for name in (args.scenario or sorted(SCENARIOS))]
+    if args.recorded:
+        runs.append(('recorded', functools.partial(RecordedFrames, args.recorded)))
+
+    if args.verify:
+        results = [verify_parallel(name, make_source, args.frames, args.workers) for name, make_source in runs]
+        sys.exit(0 if all(results) else 1)
+
+    results = []
+    for name, make_source in runs:
+        result = run_scenario(name, make_source(), args.frames, args.workers, delta_encoding=not args.no_delta)
+        print_result(result)
+        results.append(result)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'size': list(args.size), 'workers': args.workers, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
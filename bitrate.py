@@ -0,0 +1,107 @@
+from threading import Lock
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class BitrateController:
+    """Điều chỉnh độ phân giải, chất lượng JPEG và fps theo tình trạng đường truyền
+
+    Sau mỗi cửa sổ đo, controller xét độ trễ hàng đợi trung bình và tỉ lệ thời gian
+    socket bận gửi. Khi nghẽn thì giảm chất lượng, rồi fps, rồi độ phân giải; khi
+    rảnh thì khôi phục theo thứ tự ngược lại.
+    """
+
+    def __init__(self, base_resolution=(1800, 900), min_scale=0.4, max_scale=1.0,
+                 min_quality=30, max_quality=85, min_fps=5, max_fps=30,
+                 target_delay=0.15, adjust_interval=1.0):
+        self.base_resolution = base_resolution
+        self.min_scale = min_scale
+        self.max_scale = max_scale
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.min_fps = min_fps
+        self.max_fps = max_fps
+        self.target_delay = target_delay
+        self.adjust_interval = adjust_interval
+        self.lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.scale = self.max_scale
+            self.quality = min(75, self.max_quality)
+            self.fps = self.max_fps
+            self.start_window(time.perf_counter())
+
+    def start_window(self, now):
+        self.window_start = now
+        self.window_frames = 0
+        self.window_bytes = 0
+        self.window_busy = 0.0
+        self.window_delay = 0.0
+        self.window_sources = set()
+
+    @property
+    def resolution(self):
+        width, height = self.base_resolution
+        # Giữ kích thước chẵn để chia tile/JPEG gọn hơn
+        return (int(width * self.scale) & ~1, int(height * self.scale) & ~1)
+
+    def report(self, nbytes, send_seconds, queue_delay, source=None):
+        """Ghi nhận một frame đã gửi: số byte, thời gian sendall, thời gian chờ trước khi gửi
+
+        source phân biệt các viewer khi broadcast; độ bận được lấy trung bình theo viewer.
+        """
+        with self.lock:
+            now = time.perf_counter()
+            self.window_sources.add(source)
+            self.window_frames += 1
+            self.window_bytes += nbytes
+            self.window_busy += send_seconds
+            self.window_delay += queue_delay
+            elapsed = now - self.window_start
+            if elapsed >= self.adjust_interval:
+                self.adjust(elapsed)
+                self.start_window(now)
+
+    def adjust(self, elapsed):
+        delay = self.window_delay / self.window_frames
+        utilization = self.window_busy / elapsed / len(self.window_sources)
+        throughput = self.window_bytes / self.window_busy if self.window_busy > 0 else 0
+
+        if delay > self.target_delay or utilization > 0.9:
+            changed = self.degrade()
+        elif delay < self.target_delay / 2 and utilization < 0.5:
+            changed = self.upgrade()
+        else:
+            changed = False
+
+        if changed:
+            logger.info(
+                f"Bitrate: delay={delay * 1000:.0f}ms util={utilization:.0%} "
+                f"throughput={throughput / 1024:.0f}KB/s -> {self.resolution} q={self.quality} fps={self.fps}"
+            )
+
+    def degrade(self):
+        if self.quality > self.min_quality:
+            self.quality = max(self.min_quality, self.quality - 10)
+        elif self.fps > self.min_fps:
+            self.fps = max(self.min_fps, int(self.fps * 0.75))
+        elif self.scale > self.min_scale:
+            self.scale = max(self.min_scale, round(self.scale - 0.1, 2))
+        else:
+            return False
+        return True
+
+    def upgrade(self):
+        if self.scale < self.max_scale:
+            self.scale = min(self.max_scale, round(self.scale + 0.1, 2))
+        elif self.fps < self.max_fps:
+            self.fps = min(self.max_fps, self.fps + 5)
+        elif self.quality < self.max_quality:
+            self.quality = min(self.max_quality, self.quality + 5)
+        else:
+            return False
+        return True
@@ -0,0 +1,176 @@
+from threading import Thread, Lock, Condition
+from collections import deque
+import time
+import logging
+from frame_protocol import is_keyframe, is_cursor
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Viewer:
+    """Một client đang xem, có hàng đợi gửi và thread gửi riêng
+
+    Con trỏ chuột nằm ở một ô riêng (chỉ giữ message mới nhất), không chiếm chỗ trong
+    hàng đợi frame nên không làm viewer bị bỏ delta và phải chờ keyframe.
+    """
+
+    def __init__(self, conn, addr, session, queue_size=3):
+        self.conn = conn
+        self.addr = addr
+        self.session = session
+        self.queue_size = queue_size
+        self.frames = deque()
+        self.cursor = None
+        self.ready = Condition()
+        # Viewer mới hoặc vừa bị bỏ frame phải chờ keyframe để đồng bộ lại
+        self.waiting_keyframe = True
+        self.dropped = 0
+        self.closed = False
+
+    def offer(self, data, keyframe):
+        """Đưa frame vào hàng đợi; trả về False nếu viewer cần keyframe"""
+        if self.waiting_keyframe:
+            if not keyframe:
+                return False
+            self.waiting_keyframe = False
+        if self.enqueue((data, time.perf_counter())):
+            return True
+        # Viewer chậm: bỏ toàn bộ delta đang chờ, gửi lại từ keyframe kế tiếp
+        self.dropped += self.clear() + 1
+        self.waiting_keyframe = True
+        return False
+
+    def enqueue(self, item):
+        with self.ready:
+            if len(self.frames) >= self.queue_size:
+                return False
+            self.frames.append(item)
+            self.ready.notify()
+        return True
+
+    def offer_cursor(self, data):
+        with self.ready:
+            self.cursor = (data, time.perf_counter())
+            self.ready.notify()
+
+    def clear(self):
+        with self.ready:
+            count = len(self.frames)
+            self.frames.clear()
+        return count
+
+    def next_message(self, timeout):
+        """(data, thời điểm vào hàng đợi) kế tiếp, con trỏ được ưu tiên; None nếu hết timeout"""
+        with self.ready:
+            self.ready.wait_for(lambda: self.cursor is not None or self.frames or self.closed, timeout)
+            if self.cursor is not None:
+                item, self.cursor = self.cursor, None
+                return item
+            if self.frames:
+                return self.frames.popleft()
+        return None
+
+    def close(self):
+        self.closed = True
+        with self.ready:
+            self.ready.notify_all()
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+
+
+class Broadcaster:
+    """Fan-out frame đã mã hoá một lần tới nhiều viewer"""
+
+    def __init__(self, send, request_keyframe, controller=None, on_empty=None):
+        self.send = send
+        self.request_keyframe = request_keyframe
+        self.controller = controller
+        self.on_empty = on_empty
+        self.viewers = []
+        self.lock = Lock()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.viewers)
+
+    def add(self, conn, addr, session):
+        viewer = Viewer(conn, addr, session)
+        with self.lock:
+            self.viewers.append(viewer)
+            count = len(self.viewers)
+        return self.start_viewer(viewer, count)
+
+    def join(self, conn, addr, session):
+        """Thêm viewer vào phiên đang chạy; None nếu không còn viewer nào (phiên đã/đang dừng)
+
+        Kiểm tra và thêm trong cùng lock với remove/close nên viewer mới không lọt vào phiên
+        vừa mất viewer cuối và bị close() của phiên đó đóng theo.
+        """
+        viewer = Viewer(conn, addr, session)
+        with self.lock:
+            if not self.viewers:
+                return None
+            self.viewers.append(viewer)
+            count = len(self.viewers)
+        return self.start_viewer(viewer, count)
+
+    def start_viewer(self, viewer, count):
+        self.request_keyframe()
+        Thread(target=self.send_loop, args=[viewer], daemon=True).start()
+        logger.info(f"Viewer {viewer.addr} đã tham gia ({count} viewer)")
+        return viewer
+
+    def remove(self, viewer):
+        with self.lock:
+            if viewer not in self.viewers:
+                return
+            self.viewers.remove(viewer)
+            count = len(self.viewers)
+            # Lấy callback trong lock: phiên mới có thể đã thay on_empty ngay sau khi lock được nhả
+            on_empty = self.on_empty if count == 0 else None
+        viewer.close()
+        logger.info(f"Viewer {viewer.addr} đã rời ({count} viewer, bỏ {viewer.dropped} frame)")
+        if on_empty:
+            on_empty()
+
+    def close(self):
+        with self.lock:
+            viewers = list(self.viewers)
+            self.viewers = []
+        for viewer in viewers:
+            viewer.close()
+
+    def publish(self, data):
+        with self.lock:
+            viewers = list(self.viewers)
+        if is_cursor(data):
+            for viewer in viewers:
+                viewer.offer_cursor(data)
+            return
+        keyframe = is_keyframe(data)
+        need_keyframe = False
+        for viewer in viewers:
+            if not viewer.offer(data, keyframe):
+                need_keyframe = True
+        if need_keyframe:
+            self.request_keyframe()
+
+    def send_loop(self, viewer):
+        while not viewer.closed:
+            item = viewer.next_message(timeout=0.5)
+            if item is None:
+                continue
+            data, queued_at = item
+            started = time.perf_counter()
+            metrics.record('queue', started - queued_at)
+            try:
+                self.send(viewer.conn, data, viewer.session)
+            except Exception as e:
+                logger.warning(f"Lỗi gửi frame tới viewer {viewer.addr}: {e}")
+                break
+            if self.controller and not is_cursor(data):
+                self.controller.report(len(data), time.perf_counter() - started, started - queued_at, source=viewer)
+        self.remove(viewer)
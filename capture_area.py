@@ -0,0 +1,56 @@
+from threading import Lock
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class CaptureArea:
+    """Vùng màn hình host được chia sẻ, do client chọn qua kênh input
+
+    Gồm một monitor theo chỉ số của mss (0 = mọi monitor gộp lại) và tuỳ chọn một hình
+    chữ nhật con (left, top, right, bottom chuẩn hoá 0..1 trong monitor đó, VD: một cửa sổ).
+    ScreenSource gọi resolve() mỗi lần chụp; `current` là vùng pixel vừa chụp để
+    InputManager và CursorTracker quy đổi toạ độ khớp với ảnh client đang thấy.
+    """
+
+    def __init__(self, monitor=1):
+        self.lock = Lock()
+        self.monitor = monitor
+        self.box = None
+        # {'left', 'top', 'width', 'height'} theo toạ độ desktop ảo; None => chưa chụp lần nào
+        self.current = None
+
+    def select(self, monitor, box=None):
+        if box is not None:
+            box = tuple(min(1.0, max(0.0, value)) for value in box)
+            # Cả monitor hoặc vùng rỗng => bỏ hình chữ nhật con
+            if box == (0.0, 0.0, 1.0, 1.0) or box[2] <= box[0] or box[3] <= box[1]:
+                box = None
+        with self.lock:
+            self.monitor = monitor
+            self.box = box
+        logger.info(f"Vùng chụp: monitor {monitor}, box {box}")
+
+    def resolve(self, monitors):
+        """Vùng pixel cần chụp từ danh sách monitor của mss (sct.monitors)"""
+        with self.lock:
+            monitor, box = self.monitor, self.box
+        if not 0 <= monitor < len(monitors):
+            logger.warning(f"Host không có monitor {monitor}, dùng monitor chính")
+            monitor = 1
+            with self.lock:
+                self.monitor = monitor
+        rect = monitors[monitor]
+        if box is None:
+            region = {'left': rect['left'], 'top': rect['top'], 'width': rect['width'], 'height': rect['height']}
+        else:
+            left = round(box[0] * rect['width'])
+            top = round(box[1] * rect['height'])
+            region = {
+                'left': rect['left'] + left,
+                'top': rect['top'] + top,
+                'width': max(1, round(box[2] * rect['width']) - left),
+                'height': max(1, round(box[3] * rect['height']) - top),
+            }
+        self.current = region
+        return region
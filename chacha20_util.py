@@ -1,38 +1,70 @@
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.backends import default_backend
+import hashlib
+import os
+import struct
+import threading
 
-def encrypt(key: str, nonce: str, plaintext: bytes) -> bytes:
-    try:
-        key = key.encode('utf-8')
-        nonce = nonce.encode('utf-8')
+SALT_SIZE = 16
+HEADER_SIZE = 4
+
+def new_salt() -> bytes:
+    return os.urandom(SALT_SIZE)
+
+def derive_nonce(nonce: str, salt: bytes, direction: bytes) -> bytes:
+    # 4 byte counter bắt đầu từ 0 + 12 byte nonce riêng cho từng kết nối và từng chiều
+    return b'\x00' * 4 + hashlib.sha256(nonce.encode('utf-8') + salt + direction).digest()[:12]
+
+class CipherStream:
+    """Một chiều của kết nối: keystream ChaCha20 chạy liên tục qua các message"""
 
+    def __init__(self, key: str, nonce: str, salt: bytes, direction: bytes):
+        key = key.encode('utf-8')
         if len(key) != 32:
             raise ValueError("Key must be 32 bytes for ChaCha20")
-        if len(nonce) != 16:
+        if len(nonce.encode('utf-8')) != 16:
             raise ValueError("Nonce must be 16 bytes for ChaCha20")
 
-        algorithm = algorithms.ChaCha20(key, nonce)
-        cipher = Cipher(algorithm, mode=None, backend=default_backend())
-        encryptor = cipher.encryptor()
-        ciphertext = encryptor.update(plaintext) + encryptor.finalize()
+        algorithm = algorithms.ChaCha20(key, derive_nonce(nonce, salt, direction))
+        self.context = Cipher(algorithm, mode=None, backend=default_backend()).encryptor()
+        self.buffer = bytearray(HEADER_SIZE)
+
+    def seal(self, plaintext) -> memoryview:
+        """Mã hoá vào buffer dùng lại, trả về message có sẵn header độ dài 4 byte
+
+        View trả về chỉ hợp lệ tới lần gọi seal() tiếp theo.
+        """
+        size = HEADER_SIZE + len(plaintext)
+        if len(self.buffer) < size:
+            self.buffer = bytearray(max(size, 2 * len(self.buffer)))
+        view = memoryview(self.buffer)
+        struct.pack_into('>I', self.buffer, 0, len(plaintext))
+        self.context.update_into(plaintext, view[HEADER_SIZE:size])
+        return view[:size]
 
-        return ciphertext
-    except Exception as e:
-        print(f"Lỗi khi mã hóa dữ liệu: {e}")
-        return b''
+    def open_into(self, ciphertext, output=None):
+        """Giải mã vào output; mặc định tại chỗ (ChaCha20 là stream cipher nên không cần buffer thứ hai)"""
+        if output is None:
+            output = ciphertext
+        self.context.update_into(ciphertext, output)
+        return output
 
-def decrypt(key: str, nonce: str, ciphertext: bytes) -> bytes:
-    key = key.encode('utf-8')
-    nonce = nonce.encode('utf-8')
+class CipherSession:
+    """Cặp keystream gửi/nhận cho một kết nối, tạo từ key chung và salt ngẫu nhiên của kết nối"""
 
-    if len(key) != 32:
-        raise ValueError("Key must be 32 bytes for ChaCha20")
-    if len(nonce) != 16:
-        raise ValueError("Nonce must be 16 bytes for ChaCha20")
+    def __init__(self, key: str, nonce: str, salt: bytes, initiator: bool):
+        outgoing, incoming = (b'c2s', b's2c') if initiator else (b's2c', b'c2s')
+        self.sender = CipherStream(key, nonce, salt, outgoing)
+        self.receiver = CipherStream(key, nonce, salt, incoming)
+        # Thứ tự mã hoá phải khớp thứ tự byte trên socket
+        self.send_lock = threading.Lock()
 
-    algorithm = algorithms.ChaCha20(key, nonce)
-    cipher = Cipher(algorithm, mode=None, backend=default_backend())
-    decryptor = cipher.decryptor()
-    plaintext = decryptor.update(ciphertext) + decryptor.finalize()
+    def send(self, sock, plaintext) -> None:
+        with self.send_lock:
+            sock.sendall(self.sender.seal(plaintext))
 
-    return plaintext
\ No newline at end of file
+    def decrypt(self, ciphertext):
+        # bytes là bất biến nên phải copy; bytearray/memoryview thì giải mã tại chỗ
+        if isinstance(ciphertext, bytes):
+            ciphertext = bytearray(ciphertext)
+        return self.receiver.open_into(ciphertext)
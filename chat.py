@@ -1,6 +1,7 @@
 import socket
+from threading import Lock
 import chacha20_util
-import struct
+import framing
 import logging
 import socket
 import json
@@ -19,54 +20,79 @@ class Chat:
         self.requestNonce = ''
         self.status = ''
         self.myIp = ''
+        self.session = None
+        self.reader = None
         self.display_message = display_message
+        # Host: conn -> CipherSession của từng client chat đang kết nối (mỗi viewer một kết nối)
+        self.peers = {}
+        self.peers_lock = Lock()
 
     def recv_all(self, conn, length):
-        data = b""
-        while len(data) < length:
-            packet = conn.recv(length - len(data))
-            if not packet:
-                return None
-            data += packet
-        return data
+        return framing.recvall(conn, length)
 
-    def recv_msg(self):
+    def recv_msg(self, reader=None, session=None):
         try:
-            raw_length = self.recv_all(self.conn, 4)
-            if not raw_length:
+            encrypted_data = (reader or self.reader).read_message()
+            if encrypted_data is None:
                 return None
-            msglen = struct.unpack('>I', raw_length)[0]
-            encrypted_data = self.recv_all(self.conn, msglen)
-            if self.status == 'host':
-                decrypt = chacha20_util.decrypt(self.key, self.nonce, encrypted_data)
-                return decrypt
-            elif self.status == 'client':
-                decrypt = chacha20_util.decrypt(self.requestKey, self.requestNonce, encrypted_data)
-                return decrypt
+            return (session or self.session).decrypt(encrypted_data)
         except Exception as e:
             logger.error(f"Lỗi khi nhân chat message: {e}")
             return None
 
-    def send_msg(self, sock, msg):
+    def send_msg(self, sock, msg, session=None):
         try:
-            if self.status == 'client':
-                encrypt = chacha20_util.encrypt(self.requestKey, self.requestNonce, msg)
-            elif self.status == 'host':
-                encrypt = chacha20_util.encrypt(self.key, self.nonce, msg)
-            data = struct.pack('>I', len(encrypt)) + encrypt
-            sock.sendall(data)
+            (session or self.session).send(sock, msg)
             logger.debug(f"Đã gửi chat message {len(msg)} bytes")
+            return True
         except Exception as e:
             logger.error(f"Lỗi khi gửi chat message: {e}")
+            return False
+
+    def add_peer(self, conn, session):
+        with self.peers_lock:
+            self.peers[conn] = session
+
+    def remove_peer(self, conn):
+        with self.peers_lock:
+            self.peers.pop(conn, None)
 
-    def receive_chat(self, stop_event, client_mode = False):
+    def serve_chat(self, conn, addr, stop_event):
+        """Host: nhận chat của một client cho tới khi mất kết nối"""
+        with conn:
+            logger.info(f"Chat client đã kết nối: {addr}")
+            salt = self.recv_all(conn, chacha20_util.SALT_SIZE)
+            if not salt:
+                return
+            session = chacha20_util.CipherSession(self.key, self.nonce, salt, initiator=False)
+            reader = framing.FramedReader(conn)
+            self.add_peer(conn, session)
+            try:
+                while not stop_event.is_set():
+                    try:
+                        raw_msg = self.recv_msg(reader, session)
+                        raw_msg = json.loads(str(raw_msg, 'utf-8'))
+                        msg_data = raw_msg
+                        if not raw_msg:
+                            logger.error(f"Mất kết nối chat")
+                            break
+                        logger.debug(f"Đã nhận message: {msg_data}")
+                        if self.display_message:
+                            self.display_message(msg_data['msg'])
+                    except Exception as e:
+                        logger.error(f"Lỗi vòng lặp receive_chat (host): {e}")
+                        break
+            finally:
+                self.remove_peer(conn)
+
+    def receive_chat(self, stop_event, client_mode = False, listener = None):
         if client_mode:
             logger.info(f"Đã kết nối đến chat host: {self.ip}")
 
             while not stop_event.is_set() and self.conn is not None:
                 try:
                     raw_msg = self.recv_msg()
-                    raw_msg = json.loads(raw_msg.decode('utf-8'))
+                    raw_msg = json.loads(str(raw_msg, 'utf-8'))
                     msg_data = raw_msg
                     if not raw_msg:
                         logger.error(f"Mất kết nối chat")
@@ -78,15 +104,12 @@ class Chat:
                     logger.error(f"Lỗi vòng lặp receive_chat (client): {e}")
                     break
         else:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as listener:
-                try:
-                    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-                    listener.bind((self.ip, self.port))
-                    listener.listen()
-                    listener.settimeout(0.5)
-                except Exception as e:
-                    logger.error(f"Lỗi khi bind/listen receive_input: {e}")
-                    return
+            try:
+                listener = listener or framing.open_listener(self.ip, self.port)
+            except Exception as e:
+                logger.error(f"Lỗi khi bind/listen receive_input: {e}")
+                return
+            with listener:
                 while not stop_event.is_set():
                     self.conn = None
                     try:
@@ -105,35 +128,28 @@ class Chat:
                     except Exception as e:
                         logger.error(f"Lỗi khi accept client chat: {e}")
                     
-                    with self.conn:
-                        logger.info(f"Chat client đã kết nối: {addr}")
-
-                        while not stop_event.is_set():
-                            try:
-                                raw_msg = self.recv_msg()
-                                raw_msg = json.loads(raw_msg.decode('utf-8'))
-                                msg_data = raw_msg
-                                if not raw_msg:
-                                    logger.error(f"Mất kết nối chat")
-                                    break
-                                logger.debug(f"Đã nhận message: {msg_data}")
-                                if self.display_message:
-                                    self.display_message(msg_data['msg'])
-                            except Exception as e:
-                                logger.error(f"Lỗi vòng lặp receive_chat (host): {e}")
-                                break
+                    self.serve_chat(self.conn, addr, stop_event)
 
     def send_chat_msg(self, msg):
+        """Host gửi tới mọi client chat, client gửi tới host; False nếu không gửi được tới ai"""
         try:
             data = {"ip": self.ip, "msg": msg}
-            self.send_msg(self.conn, json.dumps(data).encode())
+            payload = json.dumps(data).encode()
+            with self.peers_lock:
+                peers = list(self.peers.items())
+            if peers:
+                sent = [self.send_msg(conn, payload, session) for conn, session in peers]
+            else:
+                sent = [self.conn is not None and self.send_msg(self.conn, payload)]
+            if not any(sent):
+                return False
             logger.info(f"Đã gửi chat message: {data}")
             return True
         except Exception as e:
             logger.error(f"Lỗi send_chat_msg: {e}")
             return False
 
-    def connect_chat(self):
+    def connect_chat(self, sock=None):
         try:
             if self.conn:
                 try:
@@ -141,8 +157,14 @@ class Chat:
                 except:
                     pass
                 self.conn = None
-            self.conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.conn.connect((self.ip, self.port))
+            if sock is None:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                sock.connect((self.ip, self.port))
+            self.conn = sock
+            salt = chacha20_util.new_salt()
+            self.conn.sendall(salt)
+            self.session = chacha20_util.CipherSession(self.requestKey, self.requestNonce, salt, initiator=True)
+            self.reader = framing.FramedReader(self.conn)
             logger.debug(f"Đã kết nối chat đến host: {self.ip}, {self.port}")
         except Exception as e:
             self.conn.close()
@@ -150,6 +172,15 @@ class Chat:
             logger.error(f"Lỗi connect_chat: {e}")
 
     def disconnect_chat(self):
+        with self.peers_lock:
+            peers, self.peers = list(self.peers), {}
+        for conn in peers:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        if self.conn is None:
+            return
         try:
             self.conn.close()
             self.conn = None
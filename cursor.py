@@ -0,0 +1,91 @@
+import sys
+import ctypes
+import logging
+import mss
+from frame_protocol import CURSOR_SHAPES, CURSOR_FIXED_MAX
+
+logger = logging.getLogger(__name__)
+
+# Cursor chuẩn của Windows (IDC_*) -> tên cursor CSS
+WINDOWS_CURSORS = {
+    32512: 'default',      # IDC_ARROW
+    32513: 'text',         # IDC_IBEAM
+    32514: 'wait',         # IDC_WAIT
+    32515: 'crosshair',    # IDC_CROSS
+    32642: 'nwse-resize',  # IDC_SIZENWSE
+    32643: 'nesw-resize',  # IDC_SIZENESW
+    32644: 'ew-resize',    # IDC_SIZEWE
+    32645: 'ns-resize',    # IDC_SIZENS
+    32646: 'move',         # IDC_SIZEALL
+    32648: 'not-allowed',  # IDC_NO
+    32649: 'pointer',      # IDC_HAND
+    32650: 'progress',     # IDC_APPSTARTING
+}
+CURSOR_SHOWING = 0x1
+
+
+class CursorTracker:
+    """Đọc vị trí và hình dạng con trỏ chuột của host, chuẩn hoá theo màn hình đang chụp
+
+    Hình dạng chỉ lấy được trên Windows (GetCursorInfo); hệ khác luôn là 'default'.
+    Con trỏ không nằm trên màn hình đang chụp được báo là 'none'. Có area (CaptureArea)
+    thì toạ độ theo vùng ScreenSource vừa chụp.
+    """
+
+    def __init__(self, monitor=1, area=None):
+        with mss.mss() as sct:
+            self.rect = dict(sct.monitors[monitor])
+        self.area = area
+        self.shapes = {}
+        self.user32 = None
+        if sys.platform == 'win32':
+            self.load_windows_cursors()
+
+    def load_windows_cursors(self):
+        from ctypes import wintypes
+
+        class CURSORINFO(ctypes.Structure):
+            _fields_ = [
+                ('cbSize', wintypes.DWORD),
+                ('flags', wintypes.DWORD),
+                ('hCursor', wintypes.HANDLE),
+                ('ptScreenPos', wintypes.POINT),
+            ]
+
+        self.CURSORINFO = CURSORINFO
+        self.user32 = ctypes.windll.user32
+        self.user32.LoadCursorW.argtypes = [wintypes.HINSTANCE, ctypes.c_void_p]
+        self.user32.LoadCursorW.restype = wintypes.HANDLE
+        for resource, name in WINDOWS_CURSORS.items():
+            handle = self.user32.LoadCursorW(None, resource)
+            if handle:
+                self.shapes[handle] = CURSOR_SHAPES.index(name)
+
+    def position_and_shape(self):
+        if self.user32 is None:
+            # Import muộn: pyautogui cần màn hình khi import, vnc (và benchmark headless) import module này
+            import pyautogui
+            x, y = pyautogui.position()
+            return x, y, CURSOR_SHAPES.index('default')
+        info = self.CURSORINFO()
+        info.cbSize = ctypes.sizeof(self.CURSORINFO)
+        if not self.user32.GetCursorInfo(ctypes.byref(info)):
+            raise ctypes.WinError()
+        if not info.flags & CURSOR_SHOWING:
+            return info.ptScreenPos.x, info.ptScreenPos.y, CURSOR_SHAPES.index('none')
+        # Cursor riêng của ứng dụng không có trong bảng chuẩn => mũi tên mặc định
+        return info.ptScreenPos.x, info.ptScreenPos.y, self.shapes.get(info.hCursor, CURSOR_SHAPES.index('default'))
+
+    def poll(self):
+        """Trả về (x, y, shape) với x, y fixed-point 0..65535 trên màn hình đang chụp"""
+        x, y, shape = self.position_and_shape()
+        rect = (self.area.current if self.area else None) or self.rect
+        x, y = x - rect['left'], y - rect['top']
+        width, height = rect['width'], rect['height']
+        if not (0 <= x < width and 0 <= y < height):
+            return 0, 0, CURSOR_SHAPES.index('none')
+        return (
+            round(x * CURSOR_FIXED_MAX / max(1, width - 1)),
+            round(y * CURSOR_FIXED_MAX / max(1, height - 1)),
+            shape,
+        )
@@ -0,0 +1,309 @@
+from PIL import Image, ImageChops
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import time
+import logging
+from frame_protocol import Region, FRAME_KEY, FRAME_DELTA, CODEC_JPEG, CODEC_PNG, CODEC_COPY, COPY
+
+logger = logging.getLogger(__name__)
+
+
+def encode_jpeg(image, quality=75):
+    buffer = BytesIO()
+    image.save(buffer, format='jpeg', quality=quality)
+    return buffer.getvalue()
+
+
+def encode_png(image, colors=None):
+    """Nén lossless; nếu biết số màu (<= 256) thì chuyển sang ảnh palette để nhỏ hơn"""
+    if colors:
+        palette = image.quantize(colors=colors, method=Image.Quantize.MEDIANCUT, dither=Image.Dither.NONE)
+        # Median cut với đúng số màu của ảnh gần như luôn giữ nguyên màu; nếu lệch thì giữ RGB
+        if ImageChops.difference(palette.convert('RGB'), image).getbbox() is None:
+            image = palette
+    buffer = BytesIO()
+    image.save(buffer, format='png')
+    return buffer.getvalue()
+
+
+def row_hashes(image):
+    stride = image.width * len(image.getbands())
+    data = image.tobytes()
+    return [hash(data[offset:offset + stride]) for offset in range(0, len(data), stride)]
+
+
+def longest_shifted_run(old, new):
+    """Tìm độ dời d != 0 sao cho nhiều hàng liên tiếp nhất thoả new[y] == old[y + d]
+
+    Ứng viên d lấy từ các hàng chỉ xuất hiện một lần trong old (bỏ qua hàng trống lặp lại).
+    Trả về (d, hàng đầu, hàng cuối) theo toạ độ new, hoặc None.
+    """
+    counts = Counter(old)
+    unique = {row: y for y, row in enumerate(old) if counts[row] == 1}
+    votes = Counter(unique[row] - y for y, row in enumerate(new) if unique.get(row, y) != y)
+    best = None
+    for shift, _ in votes.most_common(3):
+        start = None
+        # Hàng cuối là lính canh để đóng đoạn đang mở
+        for y in range(max(0, -shift), min(len(new), len(old) - shift) + 1):
+            if y + shift < len(old) and y < len(new) and new[y] == old[y + shift]:
+                if start is None:
+                    start = y
+            elif start is not None:
+                if best is None or y - start > best[2] - best[1]:
+                    best = (shift, start, y)
+                start = None
+    return best
+
+
+class TileEncoder:
+    """Chia frame thành các tile cố định, chỉ gửi các tile thay đổi so với frame trước
+
+    Với workers > 1, frame được scale theo dải (xem resize), rồi chia thành các dải ngang
+    (bội số của tile) để so sánh và nén trên worker riêng. Pillow nhả GIL trong resize và
+    nén JPEG nên thread pool chạy song song thật trên nhiều core.
+
+    Codec được chọn theo nội dung từng region: vùng có tối đa palette_colors màu
+    (chữ, UI) dùng PNG lossless, vùng ảnh chụp/video dùng JPEG. palette_colors=0 => luôn JPEG.
+
+    Với copy_rect, delta bắt đầu bằng một region copy-rect khi một vùng lớn bị dời theo
+    chiều dọc hoặc ngang (cuộn, kéo cửa sổ); các tile được so với frame trước đã áp dụng
+    phép chép nên chỉ phần mới lộ ra phải nén lại.
+    """
+
+    def __init__(self, tile_size=64, keyframe_interval=120, quality=75, workers=1, palette_colors=256, copy_rect=True):
+        self.tile_size = tile_size
+        self.keyframe_interval = keyframe_interval
+        self.quality = quality
+        self.palette_colors = palette_colors
+        self.copy_rect = copy_rect
+        self.workers = max(1, workers)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='encode') if self.workers > 1 else None
+        self.previous = None
+        self.frames_since_keyframe = 0
+        self.force_keyframe = True
+        self.frame_id = 0
+
+    def reset(self):
+        """Bỏ frame tham chiếu, frame kế tiếp sẽ là keyframe (VD: client mới kết nối)"""
+        self.previous = None
+        self.force_keyframe = True
+
+    def request_keyframe(self):
+        self.force_keyframe = True
+
+    def map(self, fn, items):
+        """Chạy fn trên từng phần tử, song song trên pool nếu có; giữ nguyên thứ tự"""
+        if self.executor is None or len(items) < 2:
+            return [fn(item) for item in items]
+        return list(self.executor.map(fn, items))
+
+    def stripes(self, size):
+        """Chia khung hình thành tối đa `workers` dải ngang, biên dải trùng biên tile"""
+        width, height = size
+        rows = -(-height // self.tile_size)
+        step = -(-rows // self.workers) * self.tile_size
+        return [(0, y, width, min(y + step, height)) for y in range(0, height, step)]
+
+    def bands(self, length):
+        """Chia [0, length) thành tối đa `workers` đoạn liên tiếp"""
+        step = -(-length // self.workers)
+        return [(start, min(start + step, length)) for start in range(0, length, step)]
+
+    def resize(self, image, size, resample=Image.Resampling.LANCZOS):
+        """Scale song song, cho kết quả trùng từng pixel với image.resize
+
+        Pillow resize theo hai lượt tách rời (ngang rồi dọc, mỗi lượt làm tròn về 8 bit):
+        lượt ngang chỉ trộn pixel trong một hàng nên chia theo dải hàng, lượt dọc chỉ trộn
+        trong một cột nên chia theo dải cột. Chia một lượt 2 chiều bằng box sẽ lệch ±1 ở
+        biên dải và làm hỏng so khớp copy-rect.
+        """
+        size = tuple(size)
+        if image.size == size:
+            return image
+        if self.executor is None:
+            return image.resize(size, resample)
+
+        width, height = size
+        src_width, src_height = image.size
+        if width != src_width:
+            def resize_rows(band):
+                top, bottom = band
+                return band, image.crop((0, top, src_width, bottom)).resize((width, bottom - top), resample)
+
+            image_rows = Image.new(image.mode, (width, src_height))
+            for (top, _), part in self.map(resize_rows, self.bands(src_height)):
+                image_rows.paste(part, (0, top))
+            image = image_rows
+        if height != src_height:
+            def resize_columns(band):
+                left, right = band
+                return band, image.crop((left, 0, right, src_height)).resize((right - left, height), resample)
+
+            result = Image.new(image.mode, size)
+            for (left, _), part in self.map(resize_columns, self.bands(width)):
+                result.paste(part, (left, 0))
+            image = result
+        return image
+
+    def dirty_tiles(self, previous, current, area=None):
+        """Trả về danh sách box (left, top, right, bottom) của các tile bị thay đổi
+
+        area giới hạn việc so sánh trong một dải (toạ độ biên phải trùng biên tile).
+        """
+        if area is None:
+            area = (0, 0) + current.size
+        if area == (0, 0) + current.size:
+            diff = ImageChops.difference(previous, current)
+        else:
+            diff = ImageChops.difference(previous.crop(area), current.crop(area))
+        bbox = diff.getbbox()
+        if bbox is None:
+            return []
+
+        width, height = diff.size
+        size = self.tile_size
+        left = bbox[0] - bbox[0] % size
+        top = bbox[1] - bbox[1] % size
+        tiles = []
+        for y in range(top, bbox[3], size):
+            for x in range(left, bbox[2], size):
+                box = (x, y, min(x + size, width), min(y + size, height))
+                if diff.crop(box).getbbox() is not None:
+                    tiles.append((box[0] + area[0], box[1] + area[1], box[2] + area[0], box[3] + area[1]))
+        return tiles
+
+    def find_copy(self, previous, current):
+        """Vùng bị dời lớn nhất giữa hai frame: (box đích, (x nguồn, y nguồn)) hoặc None
+
+        Chỉ xét trong bbox thay đổi; so khớp theo hash từng hàng (cuộn dọc) rồi từng cột
+        (cuộn ngang). Vùng phải dài ít nhất một tile theo chiều dời mới đáng chép.
+        """
+        bbox = ImageChops.difference(previous, current).getbbox()
+        if bbox is None or bbox[2] - bbox[0] < self.tile_size or bbox[3] - bbox[1] < self.tile_size:
+            return None
+        left, top, right, bottom = bbox
+        old, new = previous.crop(bbox), current.crop(bbox)
+
+        run = longest_shifted_run(row_hashes(old), row_hashes(new))
+        if run is not None and run[2] - run[1] >= self.tile_size:
+            shift, start, end = run
+            return (left, top + start, right, top + end), (left, top + start + shift)
+
+        run = longest_shifted_run(row_hashes(old.transpose(Image.Transpose.TRANSPOSE)),
+                                  row_hashes(new.transpose(Image.Transpose.TRANSPOSE)))
+        if run is not None and run[2] - run[1] >= self.tile_size:
+            shift, start, end = run
+            return (left + start, top, left + end, bottom), (left + start + shift, top)
+        return None
+
+    def count_colors(self, image):
+        """Số màu của ảnh nếu ít hơn palette_colors (vùng chữ/UI), ngược lại None"""
+        if not self.palette_colors:
+            return None
+        colors = image.getcolors(self.palette_colors)
+        return len(colors) if colors is not None else None
+
+    def encode_region(self, image, box):
+        tile = image.crop(box)
+        colors = self.count_colors(tile)
+        if colors is not None:
+            codec, data = CODEC_PNG, encode_png(tile, colors)
+        else:
+            codec, data = CODEC_JPEG, encode_jpeg(tile, self.quality)
+        return Region(box[0], box[1], box[2] - box[0], box[3] - box[1], codec, data)
+
+    def palette_runs(self, image, box):
+        """Các đoạn tile liên tiếp trên cùng hàng có ít màu, trả về box trong toạ độ frame"""
+        size = self.tile_size
+        runs = []
+        for y in range(box[1], box[3], size):
+            start = None
+            for x in range(box[0], box[2], size):
+                tile = (x, y, min(x + size, box[2]), min(y + size, box[3]))
+                if self.count_colors(image.crop(tile)) is not None:
+                    if start is None:
+                        start = x
+                    end = tile[2]
+                elif start is not None:
+                    runs.append((start, y, end, tile[3]))
+                    start = None
+            if start is not None:
+                runs.append((start, y, end, min(y + size, box[3])))
+        return runs
+
+    def encode_keyframe_stripe(self, image, box):
+        """Keyframe của một dải: một region nếu cả dải cùng loại nội dung; nếu lẫn lộn thì
+        nền JPEG cho cả dải và các đoạn chữ/UI được vẽ đè lên bằng PNG (client vẽ theo thứ tự region)"""
+        if self.count_colors(image.crop(box)) is not None:
+            return [self.encode_region(image, box)]
+        runs = self.palette_runs(image, box) if self.palette_colors else []
+        if not runs:
+            return [self.encode_region(image, box)]
+
+        # Tô phẳng các đoạn sẽ bị vẽ đè để phần JPEG bên dưới gần như không tốn byte
+        background = image.crop(box)
+        for run in runs:
+            local = (run[0] - box[0], run[1] - box[1], run[2] - box[0], run[3] - box[1])
+            background.paste(background.getpixel(local[:2]), local)
+        regions = [Region(box[0], box[1], box[2] - box[0], box[3] - box[1], CODEC_JPEG,
+                          encode_jpeg(background, self.quality))]
+        for run in runs:
+            tile = image.crop(run)
+            regions.append(Region(run[0], run[1], run[2] - run[0], run[3] - run[1], CODEC_PNG,
+                                  encode_png(tile, self.count_colors(tile))))
+        return regions
+
+    def keepalive(self, timestamp=None):
+        """Delta không có region: báo cho client biết host vẫn sống khi màn hình đứng yên"""
+        self.frame_id = (self.frame_id + 1) & 0xFFFFFFFF
+        return {
+            'type': FRAME_DELTA,
+            'id': self.frame_id,
+            'size': self.previous.size,
+            'timestamp': time.time() if timestamp is None else timestamp,
+            'regions': [],
+        }
+
+    def encode(self, image, timestamp=None):
+        """Mã hoá frame thành dict {type, id, size, timestamp, regions} theo frame_protocol"""
+        keyframe = (
+            self.force_keyframe
+            or self.previous is None
+            or self.previous.size != image.size
+            or self.frames_since_keyframe >= self.keyframe_interval
+        )
+
+        if keyframe:
+            # Keyframe gồm các region của từng dải; client ghép lại theo toạ độ
+            stripes = self.map(lambda box: self.encode_keyframe_stripe(image, box), self.stripes(image.size))
+            regions = [region for stripe in stripes for region in stripe]
+            self.frames_since_keyframe = 0
+            self.force_keyframe = False
+        else:
+            previous = self.previous
+            regions = []
+            copy = self.find_copy(previous, image) if self.copy_rect else None
+            if copy is not None:
+                box, source = copy
+                regions.append(Region(box[0], box[1], box[2] - box[0], box[3] - box[1], CODEC_COPY, COPY.pack(*source)))
+                # So tile với màn hình client sau khi chép, không phải với frame trước
+                previous = previous.copy()
+                previous.paste(self.previous.crop(source + (source[0] + box[2] - box[0], source[1] + box[3] - box[1])), box[:2])
+            stripes = self.map(
+                lambda area: [self.encode_region(image, box) for box in self.dirty_tiles(previous, image, area)],
+                self.stripes(image.size),
+            )
+            regions += [region for stripe in stripes for region in stripe]
+            self.frames_since_keyframe += 1
+
+        self.previous = image
+        self.frame_id = (self.frame_id + 1) & 0xFFFFFFFF
+        return {
+            'type': FRAME_KEY if keyframe else FRAME_DELTA,
+            'id': self.frame_id,
+            'size': image.size,
+            'timestamp': time.time() if timestamp is None else timestamp,
+            'regions': regions,
+        }
@@ -0,0 +1,126 @@
+from collections import namedtuple
+import base64
+import struct
+
+# Header: magic, version, loại frame, frame id, rộng, cao, codec mặc định, timestamp, số region
+HEADER = struct.Struct('>2sBBIHHBdH')
+# Region: x, y, rộng, cao, codec, độ dài payload
+REGION = struct.Struct('>HHHHBI')
+
+MAGIC = b'VF'
+# 2: thêm FRAME_CURSOR và CODEC_COPY (client cũ không hiểu nên phải từ chối)
+VERSION = 2
+
+FRAME_KEY = 0
+FRAME_DELTA = 1
+# Chỉ vị trí/hình dạng con trỏ chuột, không có region; độc lập với keyframe/delta
+FRAME_CURSOR = 2
+
+# Con trỏ: x, y (fixed-point 0..65535 trên toàn frame), hình dạng (chỉ số trong CURSOR_SHAPES)
+CURSOR = struct.Struct('>HHB')
+# Tên cursor CSS, client để trình duyệt tự vẽ con trỏ theo chuột local
+CURSOR_SHAPES = (
+    'default', 'none', 'text', 'wait', 'progress', 'crosshair', 'pointer', 'move',
+    'ew-resize', 'ns-resize', 'nwse-resize', 'nesw-resize', 'not-allowed',
+)
+CURSOR_FIXED_MAX = 0xFFFF
+
+CODEC_JPEG = 1
+# Lossless (palette + zlib) cho vùng ít màu như chữ, UI
+CODEC_PNG = 2
+# Copy-rect: chép vùng (x nguồn, y nguồn) đang có trên màn hình client tới toạ độ region,
+# payload là COPY; dùng khi cuộn/kéo cửa sổ thay vì gửi lại ảnh
+CODEC_COPY = 3
+COPY = struct.Struct('>HH')
+
+CODEC_MIME = {
+    CODEC_JPEG: 'image/jpeg',
+    CODEC_PNG: 'image/png',
+}
+
+Region = namedtuple('Region', ['x', 'y', 'width', 'height', 'codec', 'data'])
+
+
+def pack_frame(frame):
+    """Đóng gói frame dict thành message nhị phân (header + các region với payload thô)"""
+    regions = frame['regions']
+    width, height = frame['size']
+    parts = [HEADER.pack(
+        MAGIC, VERSION, frame['type'], frame['id'], width, height,
+        frame.get('codec', CODEC_JPEG), frame['timestamp'], len(regions),
+    )]
+    for region in regions:
+        parts.append(REGION.pack(region.x, region.y, region.width, region.height, region.codec, len(region.data)))
+        parts.append(region.data)
+    return b''.join(parts)
+
+
+def pack_cursor(cursor_id, x, y, shape, timestamp):
+    """Message con trỏ: header không có region, theo sau là CURSOR"""
+    return HEADER.pack(MAGIC, VERSION, FRAME_CURSOR, cursor_id, 0, 0, 0, timestamp, 0) + CURSOR.pack(x, y, shape)
+
+
+def is_keyframe(data):
+    return HEADER.unpack_from(data, 0)[2] == FRAME_KEY
+
+
+def is_cursor(data):
+    return HEADER.unpack_from(data, 0)[2] == FRAME_CURSOR
+
+
+def unpack_frame(data):
+    """Giải message nhị phân; payload của region là memoryview trỏ vào data, không copy"""
+    view = memoryview(data)
+    magic, version, frame_type, frame_id, width, height, codec, timestamp, count = HEADER.unpack_from(view, 0)
+    if magic != MAGIC:
+        raise ValueError("Sai magic của frame")
+    if version != VERSION:
+        raise ValueError(f"Không hỗ trợ phiên bản frame {version}")
+
+    offset = HEADER.size
+    regions = []
+    for _ in range(count):
+        x, y, w, h, region_codec, length = REGION.unpack_from(view, offset)
+        offset += REGION.size
+        regions.append(Region(x, y, w, h, region_codec, view[offset:offset + length]))
+        offset += length
+
+    cursor = None
+    if frame_type == FRAME_CURSOR:
+        x, y, shape = CURSOR.unpack_from(view, offset)
+        offset += CURSOR.size
+        cursor = {
+            'x': x / CURSOR_FIXED_MAX,
+            'y': y / CURSOR_FIXED_MAX,
+            'shape': CURSOR_SHAPES[shape] if shape < len(CURSOR_SHAPES) else 'default',
+        }
+    if offset != len(view):
+        raise ValueError("Frame bị cắt hoặc thừa dữ liệu")
+
+    frame = {
+        'type': frame_type,
+        'id': frame_id,
+        'size': (width, height),
+        'codec': codec,
+        'timestamp': timestamp,
+        'regions': regions,
+    }
+    if cursor is not None:
+        frame['cursor'] = cursor
+    return frame
+
+
+def frame_to_ui(frame):
+    """Chuyển frame sang dạng JSON cho UI; chỉ ở đây mới base64 vì trình duyệt cần data URL"""
+    return {
+        'type': 'key' if frame['type'] == FRAME_KEY else 'delta',
+        'size': list(frame['size']),
+        'tiles': [region_to_ui(region) for region in frame['regions']],
+    }
+
+
+def region_to_ui(region):
+    """[x, y, data URL]; copy-rect là [x, y, [x nguồn, y nguồn, rộng, cao]]"""
+    if region.codec == CODEC_COPY:
+        return [region.x, region.y, [*COPY.unpack(region.data), region.width, region.height]]
+    return [region.x, region.y, f"data:{CODEC_MIME[region.codec]};base64,{base64.b64encode(region.data).decode('ascii')}"]
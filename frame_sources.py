@@ -0,0 +1,142 @@
+from PIL import Image, ImageDraw
+import os
+import random
+import time
+
+# Nguồn frame thay thế ScreenSource (cùng giao diện: context manager + grab()) để chạy
+# pipeline không cần màn hình thật: benchmark, test loopback.
+
+
+class SyntheticSource:
+    """Nguồn frame tổng hợp, tái lập được nhờ seed cố định"""
+
+    def __init__(self, size=(1920, 1080), seed=0):
+        self.size = size
+        self.seed = seed
+        self.frame_number = 0
+
+    def __enter__(self):
+        self.frame_number = 0
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def grab(self):
+        image = self.render(self.frame_number)
+        self.frame_number += 1
+        image.info['captured_at'] = time.time()
+        return image
+
+    def render(self, frame_number):
+        raise NotImplementedError
+
+
+def draw_desktop(size, seed):
+    """Nền gradient, taskbar và vài cửa sổ có chữ, giống một desktop làm việc"""
+    rng = random.Random(seed)
+    width, height = size
+    image = Image.linear_gradient('L').resize(size).convert('RGB')
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, height - 40, width, height), fill=(32, 32, 40))
+    for _ in range(4):
+        left, top = rng.randrange(0, width // 2), rng.randrange(0, height // 2)
+        right, bottom = left + rng.randrange(300, width // 2), top + rng.randrange(200, height // 2)
+        draw.rectangle((left, top, right, bottom), fill=(250, 250, 250), outline=(90, 90, 90))
+        draw.rectangle((left, top, right, top + 24), fill=(60, 90, 160))
+        for y in range(top + 32, bottom - 12, 14):
+            draw.text((left + 8, y), "lorem ipsum dolor sit amet " * rng.randrange(1, 4), fill=(20, 20, 20))
+    return image
+
+
+class StaticDesktop(SyntheticSource):
+    """Màn hình đứng yên: grab() luôn trả về cùng một ảnh (như ScreenSource khi không đổi)"""
+
+    def __enter__(self):
+        super().__enter__()
+        self.image = draw_desktop(self.size, self.seed)
+        return self
+
+    def render(self, frame_number):
+        return self.image
+
+
+class ScrollingText(SyntheticSource):
+    """Editor/terminal cuộn chữ: mỗi frame cuộn `speed` pixel (mặc định 3 dòng như một nấc cuộn chuột)"""
+
+    def __init__(self, size=(1920, 1080), seed=0, speed=42, line_height=14):
+        super().__init__(size, seed)
+        self.speed = speed
+        self.line_height = line_height
+
+    def __enter__(self):
+        super().__enter__()
+        rng = random.Random(self.seed)
+        width, height = self.size
+        self.page = Image.new('RGB', (width, height * 4), (30, 30, 30))
+        draw = ImageDraw.Draw(self.page)
+        words = ['def', 'return', 'self', 'frame', 'encode', 'import', 'for', 'in', 'range', 'if', 'None']
+        for number, y in enumerate(range(0, self.page.height, self.line_height)):
+            line = ' ' * rng.randrange(0, 12) + ' '.join(rng.choice(words) for _ in range(rng.randrange(2, 14)))
+            draw.text((8, y), f"{number:5d}  {line}", fill=(200, 220, 160))
+        return self
+
+    def render(self, frame_number):
+        width, height = self.size
+        offset = (frame_number * self.speed) % (self.page.height - height)
+        return self.page.crop((0, offset, width, offset + height))
+
+
+class VideoPlayback(SyntheticSource):
+    """Desktop tĩnh với một vùng video chuyển động liên tục (nội dung dạng ảnh chụp)"""
+
+    def __init__(self, size=(1920, 1080), seed=0, video_size=(960, 540), frames=30):
+        super().__init__(size, seed)
+        self.video_size = video_size
+        self.frames = frames
+
+    def __enter__(self):
+        super().__enter__()
+        rng = random.Random(self.seed)
+        width, height = self.video_size
+        self.desktop = draw_desktop(self.size, self.seed)
+        # Nhiễu độ phân giải thấp phóng to => vùng mịn nhiều màu giống video
+        self.clips = [
+            Image.frombytes('RGB', (width // 16, height // 16), rng.randbytes(width // 16 * height // 16 * 3))
+            .resize(self.video_size, Image.Resampling.BICUBIC)
+            for _ in range(self.frames)
+        ]
+        return self
+
+    def render(self, frame_number):
+        image = self.desktop.copy()
+        image.paste(self.clips[frame_number % len(self.clips)], (self.size[0] // 8, self.size[1] // 8))
+        return image
+
+
+class RecordedFrames:
+    """Phát lại các ảnh chụp màn hình đã lưu trong một thư mục (theo thứ tự tên file), lặp vòng"""
+
+    EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+    def __init__(self, path):
+        self.path = path
+        self.frames = []
+        self.frame_number = 0
+
+    def __enter__(self):
+        names = sorted(name for name in os.listdir(self.path) if name.lower().endswith(self.EXTENSIONS))
+        if not names:
+            raise ValueError(f"Không có ảnh nào trong {self.path}")
+        self.frames = [Image.open(os.path.join(self.path, name)).convert('RGB') for name in names]
+        self.frame_number = 0
+        return self
+
+    def __exit__(self, *exc):
+        self.frames = []
+
+    def grab(self):
+        image = self.frames[self.frame_number % len(self.frames)]
+        self.frame_number += 1
+        image.info['captured_at'] = time.time()
+        return image
@@ -0,0 +1,64 @@
+import socket
+import struct
+
+HEADER = struct.Struct('>I')
+MAX_MESSAGE_SIZE = 64 * 1024 * 1024
+
+
+def recv_exact(sock, view):
+    """Đọc đủ len(view) byte thẳng vào view bằng recv_into; trả về False nếu socket đóng"""
+    received = 0
+    size = len(view)
+    while received < size:
+        count = sock.recv_into(view[received:], size - received)
+        if not count:
+            return False
+        received += count
+    return True
+
+
+def recvall(sock, n):
+    data = bytearray(n)
+    if not recv_exact(sock, memoryview(data)):
+        return None
+    return data
+
+
+class FramedReader:
+    """Đọc message có header độ dài 4 byte vào một buffer dùng lại cho cả kết nối
+
+    Buffer chỉ lớn lên khi gặp message lớn hơn. View trả về bởi read_message()
+    chỉ hợp lệ tới lần đọc tiếp theo; stage sau phải xử lý (hoặc copy) trước đó.
+    """
+
+    def __init__(self, sock, initial_size=64 * 1024):
+        self.sock = sock
+        self.header = bytearray(HEADER.size)
+        self.buffer = bytearray(initial_size)
+
+    def read_message(self):
+        if not recv_exact(self.sock, memoryview(self.header)):
+            return None
+        (length,) = HEADER.unpack(self.header)
+        if length > MAX_MESSAGE_SIZE:
+            raise ValueError(f"Message quá lớn ({length} bytes)")
+        if length > len(self.buffer):
+            self.buffer = bytearray(max(length, 2 * len(self.buffer)))
+        view = memoryview(self.buffer)[:length]
+        if not recv_exact(self.sock, view):
+            return None
+        return view
+
+
+def open_listener(ip, port, timeout=0.5):
+    """Tạo socket lắng nghe với timeout để vòng accept kiểm tra được stop_event"""
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((ip, port))
+        listener.listen()
+        listener.settimeout(timeout)
+    except Exception:
+        listener.close()
+        raise
+    return listener
@@ -1,13 +1,28 @@
 import socket
 import time
-import pyautogui
-import struct
 import logging
-from pynput import mouse, keyboard
+import ast
 import chacha20_util
+import framing
+from metrics import metrics
+from input_protocol import (
+    InputEvent, pack_events, unpack_events, to_fixed, from_fixed, clamp_code, to_wheel, from_wheel,
+    pack_capture_area, pack_viewport, is_control, unpack_control,
+    MOUSE_MOVE, MOUSE_DOWN, MOUSE_UP, KEY_DOWN, KEY_UP, WHEEL, CAPTURE_AREA, VIEWPORT,
+)
 
 logger = logging.getLogger(__name__)
 
+# Tên nút trong pynput mouse.Button
+MOUSE_BUTTONS = {
+    0: 'left',
+    1: 'middle',
+    2: 'right',
+}
+
+# deltaY trình duyệt gửi cho một nấc wheel chuẩn
+WHEEL_NOTCH = 100
+
 class InputManager:
 
     def __init__(self, ip='0.0.0.0', port=6969):
@@ -25,39 +40,51 @@ class InputManager:
         self.port = port
         self.conn = None
         self.width, self.height = (0, 0)
+        self.sequence = 0
+        self.session = None
+        # CaptureArea dùng chung với VNC của host: toạ độ chuột quy đổi theo vùng đang chụp
+        self.capture_area = None
+        # Host: nhận (rộng, cao, pixel ratio) client báo, VD: VNC.set_viewport
+        self.on_viewport = None
+        # Host: phần lẻ (theo nấc) của wheel chưa inject, cộng dồn qua các event
+        self.wheel_steps = 0.0
 
     # ---------------- Socket helpers ----------------
 
+    def open_session(self, sock):
+        """Client gửi salt ngẫu nhiên của kết nối và tạo cipher session tương ứng"""
+        salt = chacha20_util.new_salt()
+        sock.sendall(salt)
+        self.session = chacha20_util.CipherSession(self.requestKey, self.requestNonce, salt, initiator=True)
+
+    def accept_session(self, sock):
+        """Host nhận salt từ client vừa kết nối, trả về cipher session hoặc None"""
+        salt = self.recvall(sock, chacha20_util.SALT_SIZE)
+        if not salt:
+            return None
+        return chacha20_util.CipherSession(self.key, self.nonce, salt, initiator=False)
+
     def send_msg(self, sock, msg):
         try:
-            encrypt = chacha20_util.encrypt(self.requestKey, self.requestNonce, msg)
-            data = struct.pack('>I', len(encrypt)) + encrypt
-            sock.sendall(data)
+            started = time.perf_counter()
+            self.session.send(sock, msg)
+            metrics.record('input_send', time.perf_counter() - started, len(msg))
             logger.debug(f"Đã gửi message {len(msg)} bytes")
         except Exception as e:
             logger.error(f"Lỗi khi gửi message: {e}")
 
-    def recv_msg(self, sock):
+    def recv_msg(self, reader, session):
         try:
-            raw_msglen = self.recvall(sock, 4)
-            if not raw_msglen:
+            encrypted_data = reader.read_message()
+            if encrypted_data is None:
                 return None
-            msglen = struct.unpack('>I', raw_msglen)[0]
-            encrypted_data = self.recvall(sock, msglen)
-            decrypt = chacha20_util.decrypt(self.key, self.nonce, encrypted_data)
-            return decrypt
+            return session.decrypt(encrypted_data)
         except Exception as e:
             logger.error(f"Lỗi khi nhận message: {e}")
             return None
     
     def recvall(self, sock, n):
-        data = b''
-        while len(data) < n:
-            packet = sock.recv(n - len(data))
-            if not packet:
-                return None
-            data += packet
-        return data
+        return framing.recvall(sock, n)
 
     # ---------------- Event handling ----------------
 
@@ -114,6 +141,7 @@ class InputManager:
         try:
             self.conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.conn.connect((self.ip, self.port))
+            self.open_session(self.conn)
             logger.info(f"Đã kết nối tới server input {self.ip}:{self.port}")
         except Exception as e:
             logger.error(f"Lỗi transmit(): {e}")
@@ -132,7 +160,12 @@ class InputManager:
 
             with conn:
                 logger.info(f"Client input đã kết nối: {addr}")
+                session = self.accept_session(conn)
+                reader = framing.FramedReader(conn)
 
+                # Import muộn: pyautogui/pynput cần màn hình khi import, loopback harness chạy headless
+                import pyautogui
+                from pynput import mouse, keyboard
                 width, height = pyautogui.size()
                 mouse_var = mouse.Controller()
                 keyboard_var = keyboard.Controller()
@@ -140,11 +173,11 @@ class InputManager:
 
                 while True:
                     try:
-                        raw_data = self.recv_msg(conn)
+                        raw_data = self.recv_msg(reader, session)
                         if not raw_data:
                             logger.warning("Mất kết nối input")
                             break
-                        received_input = eval(raw_data.decode())
+                        received_input = ast.literal_eval(str(raw_data, 'utf-8'))
                         logger.debug(f"Nhận input: {received_input}")
 
                         # Mouse
@@ -168,7 +201,7 @@ class InputManager:
                         # Keyboard
                         for k in received_input['keys']:
                             try:
-                                keyboard_var.press(str(eval(k)))
+                                keyboard_var.press(str(ast.literal_eval(k)))
                                 logger.debug(f"Key press: {k}")
                             except Exception:
                                 pass
@@ -179,7 +212,7 @@ class InputManager:
 
     # ---------------- EEL roles ----------------
 
-    def connect_input(self):
+    def connect_input(self, sock=None):
         try:
             if self.conn:
                 try:
@@ -187,8 +220,11 @@ class InputManager:
                 except:
                     pass
                 self.conn = None
-            self.conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.conn.connect((self.ip, self.port))
+            if sock is None:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                sock.connect((self.ip, self.port))
+            self.conn = sock
+            self.open_session(self.conn)
             logger.info(f"Đã kết nối tới input server {self.ip}:{self.port}")
         except Exception as e:
             self.conn.close()
@@ -203,33 +239,137 @@ class InputManager:
         except Exception as e:
             logger.error(f"Lỗi disconnect_input: {e}")
 
+    def make_event(self, event_type, pos=None, button=0, code=0):
+        self.sequence = (self.sequence + 1) & 0xFFFFFFFF
+        x, y = pos if pos else (0, 0)
+        return InputEvent(event_type, button, to_fixed(x), to_fixed(y), clamp_code(code), self.sequence)
+
+    def transmit_events(self, events):
+        """Gửi nhiều event trong một message đã mã hoá"""
+        if events:
+            self.send_msg(self.conn, pack_events(events))
+
+    def build_events(self, mouse_pos=None, mouse_down=None, mouse_up=None, keydown=None, keyup=None, wheel=None):
+        events = []
+        if mouse_down is not None:
+            events.append(self.make_event(MOUSE_DOWN, mouse_pos, button=mouse_down))
+        elif mouse_up is not None:
+            events.append(self.make_event(MOUSE_UP, mouse_pos, button=mouse_up))
+        elif mouse_pos:
+            events.append(self.make_event(MOUSE_MOVE, mouse_pos))
+        if wheel and to_wheel(wheel):
+            events.append(self.make_event(WHEEL, code=to_wheel(wheel)))
+        if keydown:
+            events.append(self.make_event(KEY_DOWN, code=keydown))
+        if keyup:
+            events.append(self.make_event(KEY_UP, code=keyup))
+        return events
+
     def transmit_input(self, mouse_pos=None, mouse_down=None, mouse_up=None, keydown=None, keyup=None, wheel=None):
         try:
-            key_input = {
-                "mouse_pos": mouse_pos,
-                "mouse_down": mouse_down,
-                "mouse_up": mouse_up,
-                "keydown": keydown,
-                "keyup": keyup,
-                "wheel": wheel
-            }
-            self.send_msg(self.conn, str(key_input).encode())
-            logger.debug(f"Đã gửi input: {key_input}")
+            events = self.build_events(mouse_pos, mouse_down, mouse_up, keydown, keyup, wheel)
+            self.transmit_events(events)
+            logger.debug(f"Đã gửi {len(events)} input event")
         except Exception as e:
             logger.error(f"Lỗi transmit_input: {e}")
 
-    def receive_input(self, stop_event):
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as listener:
-            try:
-                listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-                listener.bind((self.ip, self.port))
-                listener.listen()
-                listener.settimeout(0.5)
-                logger.info(f"Đang chờ input client tại {self.ip}:{self.port}...")
-            except Exception as e:
-                logger.error(f"Lỗi khi bind/listen receive_input: {e}")
-                return
-            
+    def transmit_capture_area(self, monitor, box=None):
+        """Client chọn monitor (0 = tất cả) và tuỳ chọn một vùng con chuẩn hoá trong monitor đó"""
+        try:
+            self.send_msg(self.conn, pack_capture_area(monitor, box))
+            logger.info(f"Đã yêu cầu vùng chụp: monitor {monitor}, box {box}")
+        except Exception as e:
+            logger.error(f"Lỗi transmit_capture_area: {e}")
+
+    def transmit_viewport(self, width, height, pixel_ratio=1.0):
+        """Client báo kích thước vùng hiển thị (CSS pixel) và devicePixelRatio để host encode vừa đủ"""
+        try:
+            self.send_msg(self.conn, pack_viewport(width, height, pixel_ratio))
+            logger.debug(f"Đã báo viewport {width}x{height} @{pixel_ratio}")
+        except Exception as e:
+            logger.error(f"Lỗi transmit_viewport: {e}")
+
+    def handle_control(self, data):
+        control_type, args = unpack_control(data)
+        if control_type == CAPTURE_AREA and self.capture_area:
+            self.capture_area.select(*args)
+        elif control_type == VIEWPORT and self.on_viewport:
+            self.on_viewport(*args)
+
+    def input_controllers(self):
+        # Import muộn: pyautogui/pynput cần màn hình khi import, loopback harness chạy headless
+        import pyautogui
+        from pynput import mouse, keyboard
+        width, height = pyautogui.size()
+        self.wheel_steps = 0.0
+        return mouse.Controller(), keyboard.Controller(), width, height
+
+    def inject_event(self, event, mouse_controller, keyboard_controller, width, height):
+        """Thực thi một input event trên máy host"""
+        from pynput import mouse, keyboard
+        if event.type in (MOUSE_MOVE, MOUSE_DOWN, MOUSE_UP):
+            area = self.capture_area.current if self.capture_area else None
+            if area is None:
+                mouse_controller.position = (from_fixed(event.x) * width, from_fixed(event.y) * height)
+            else:
+                mouse_controller.position = (area['left'] + from_fixed(event.x) * area['width'],
+                                             area['top'] + from_fixed(event.y) * area['height'])
+
+        if event.type == MOUSE_DOWN and event.button in MOUSE_BUTTONS:
+            mouse_controller.press(getattr(mouse.Button, MOUSE_BUTTONS[event.button]))
+        elif event.type == MOUSE_UP and event.button in MOUSE_BUTTONS:
+            mouse_controller.release(getattr(mouse.Button, MOUSE_BUTTONS[event.button]))
+        elif event.type == WHEEL:
+            # deltaY dương là cuộn xuống, pynput dy dương là cuộn lên; chỉ inject số nấc nguyên
+            self.wheel_steps -= from_wheel(event.code) / WHEEL_NOTCH
+            steps = int(self.wheel_steps)
+            if steps:
+                self.wheel_steps -= steps
+                mouse_controller.scroll(dx=0, dy=steps)
+        elif event.type == KEY_DOWN:
+            keyboard_controller.press(keyboard.KeyCode(event.code))
+        elif event.type == KEY_UP:
+            keyboard_controller.release(keyboard.KeyCode(event.code))
+
+    def serve_input(self, conn, addr, stop_event):
+        """Host: nhận và inject input của một client cho tới khi mất kết nối"""
+        with conn:
+            logger.info(f"Input client đã kết nối: {addr}")
+            session = self.accept_session(conn)
+            reader = framing.FramedReader(conn)
+
+            mouse_controller, keyboard_controller, width, height = self.input_controllers()
+
+            while not stop_event.is_set():
+                try:
+                    raw_data = self.recv_msg(reader, session)
+                    if not raw_data:
+                        logger.warning("Mất kết nối input client")
+                        break
+
+                    if is_control(raw_data):
+                        self.handle_control(raw_data)
+                        continue
+                    events = unpack_events(raw_data)
+                    logger.debug(f"Nhận {len(events)} input event")
+                    started = time.perf_counter()
+                    for event in events:
+                        self.inject_event(event, mouse_controller, keyboard_controller, width, height)
+                    metrics.record('input_inject', time.perf_counter() - started, len(raw_data))
+
+                except Exception as e:
+                    logger.error(f"Lỗi vòng lặp receive_input: {e}")
+                    break
+
+    def receive_input(self, stop_event, listener=None):
+        try:
+            listener = listener or framing.open_listener(self.ip, self.port)
+            logger.info(f"Đang chờ input client tại {self.ip}:{self.port}...")
+        except Exception as e:
+            logger.error(f"Lỗi khi bind/listen receive_input: {e}")
+            return
+
+        with listener:
             while not stop_event.is_set():
                 conn = None
                 try:
@@ -249,55 +389,5 @@ class InputManager:
                     logger.error(f"Lỗi khi accept client: {e}")
                     return
 
-                with conn:
-                    logger.info(f"Input client đã kết nối: {addr}")
-
-                    width, height = pyautogui.size()
-                    mouse_controller = mouse.Controller()
-                    keyboard_controller = keyboard.Controller()
-
-                    while not stop_event.is_set():
-                        try:
-                            raw_data = self.recv_msg(conn)
-                            if not raw_data:
-                                logger.warning("Mất kết nối input client")
-                                break
-
-                            received_input = eval(raw_data.decode())
-                            logger.debug(f"Nhận input: {received_input}")
-
-                            mouse_input = received_input['mouse_pos']
-                            wheel_input = received_input['wheel']
-                            if mouse_input:
-                                mouse_input[0] *= width
-                                mouse_input[1] *= height
-                                mouse_controller.position = tuple(mouse_input)
-
-                            if received_input['mouse_down'] == 0:
-                                mouse_controller.press(mouse.Button.left)
-                            if received_input['mouse_up'] == 0:
-                                mouse_controller.release(mouse.Button.left)
-
-                            if received_input['mouse_down'] == 1:
-                                mouse_controller.press(mouse.Button.middle)
-                            if received_input['mouse_up'] == 1:
-                                mouse_controller.release(mouse.Button.middle)
-
-                            if received_input['mouse_down'] == 2:
-                                mouse_controller.press(mouse.Button.right)
-                            if received_input['mouse_up'] == 2:
-                                mouse_controller.release(mouse.Button.right)
-
-                            if received_input['wheel']:
-                                mouse_controller.scroll(dx=0, dy=-180/wheel_input)
-
-                            if received_input['keydown']:
-                                keyboard_controller.press(keyboard.KeyCode(received_input['keydown']))
-                            if received_input['keyup']:
-                                keyboard_controller.release(keyboard.KeyCode(received_input['keyup']))
-
-                        except Exception as e:
-                            logger.error(f"Lỗi vòng lặp receive_input: {e}")
-                            break
-
+                self.serve_input(conn, addr, stop_event)
                 logger.info("Client input đã ngắt kết nối — chuẩn bị accept client mới...")
\ No newline at end of file
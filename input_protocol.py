@@ -0,0 +1,99 @@
+from collections import namedtuple
+import struct
+
+# Event: loại, nút chuột, x, y (fixed-point 0..65535 trên toàn màn hình), code (mã phím / delta wheel
+# fixed-point WHEEL_FIXED), số thứ tự
+EVENT = struct.Struct('>BBHHhI')
+# Message: số event, theo sau là các event
+COUNT = struct.Struct('>H')
+
+MOUSE_MOVE = 1
+MOUSE_DOWN = 2
+MOUSE_UP = 3
+KEY_DOWN = 4
+KEY_UP = 5
+WHEEL = 6
+
+FIXED_POINT_MAX = 0xFFFF
+# deltaY của wheel gửi theo đơn vị 1/WHEEL_FIXED pixel: giữ được delta lẻ của trackpad (|deltaY| < 1)
+WHEEL_FIXED = 16
+
+InputEvent = namedtuple('InputEvent', ['type', 'button', 'x', 'y', 'code', 'seq'])
+
+
+def to_fixed(value):
+    """Toạ độ chuẩn hoá [0, 1] -> số nguyên 16 bit"""
+    return max(0, min(FIXED_POINT_MAX, round(value * FIXED_POINT_MAX)))
+
+
+def from_fixed(value):
+    return value / FIXED_POINT_MAX
+
+
+def clamp_code(value):
+    return max(-0x8000, min(0x7FFF, int(round(value))))
+
+
+def to_wheel(delta):
+    """deltaY (pixel, có dấu) -> code fixed-point"""
+    return clamp_code(delta * WHEEL_FIXED)
+
+
+def from_wheel(code):
+    return code / WHEEL_FIXED
+
+
+def pack_events(events):
+    """Gộp nhiều event vào một message để mã hoá và gửi một lần"""
+    parts = [COUNT.pack(len(events))]
+    for event in events:
+        parts.append(EVENT.pack(*event))
+    return b''.join(parts)
+
+
+def unpack_events(data):
+    (count,) = COUNT.unpack_from(data, 0)
+    if len(data) != COUNT.size + count * EVENT.size:
+        raise ValueError("Message input sai kích thước")
+    return [InputEvent(*fields) for fields in EVENT.iter_unpack(memoryview(data)[COUNT.size:])]
+
+
+# Message điều khiển đi cùng kênh input, phân biệt với message event bằng COUNT = CONTROL_MARKER
+CONTROL_MARKER = 0xFFFF
+CONTROL = struct.Struct('>HB')
+
+# Chọn vùng chụp: monitor (chỉ số mss, 0 = tất cả), left, top, right, bottom fixed-point trong monitor
+CAPTURE_AREA = 1
+AREA = struct.Struct('>BHHHH')
+
+# Kích thước vùng hiển thị của client: rộng, cao (CSS pixel), devicePixelRatio x 100
+VIEWPORT = 2
+VIEWPORT_SIZE = struct.Struct('>HHH')
+
+
+def pack_capture_area(monitor, box=None):
+    left, top, right, bottom = box or (0.0, 0.0, 1.0, 1.0)
+    return CONTROL.pack(CONTROL_MARKER, CAPTURE_AREA) + AREA.pack(
+        monitor, to_fixed(left), to_fixed(top), to_fixed(right), to_fixed(bottom))
+
+
+def pack_viewport(width, height, pixel_ratio=1.0):
+    fields = (width, height, pixel_ratio * 100)
+    return CONTROL.pack(CONTROL_MARKER, VIEWPORT) + VIEWPORT_SIZE.pack(*(max(1, min(0xFFFF, round(value))) for value in fields))
+
+
+def is_control(data):
+    return COUNT.unpack_from(data, 0)[0] == CONTROL_MARKER
+
+
+def unpack_control(data):
+    """(loại, tham số) của message điều khiển; ValueError nếu không hỗ trợ"""
+    _, control_type = CONTROL.unpack_from(data, 0)
+    payload = memoryview(data)[CONTROL.size:]
+    if control_type == CAPTURE_AREA:
+        monitor, *box = AREA.unpack(payload)
+        return control_type, (monitor, tuple(from_fixed(value) for value in box))
+    if control_type == VIEWPORT:
+        width, height, pixel_ratio = VIEWPORT_SIZE.unpack(payload)
+        return control_type, (width, height, pixel_ratio / 100)
+    raise ValueError(f"Không hỗ trợ message điều khiển {control_type}")
@@ -0,0 +1,82 @@
+from logging.handlers import QueueHandler, QueueListener
+from threading import Lock
+import atexit
+import logging
+import queue
+import sys
+
+LOG_FORMAT = "[%(asctime)s] [%(levelname)s] %(message)s"
+
+
+class RateLimitFilter(logging.Filter):
+    """Giới hạn số log từ cùng một dòng code trong mỗi khoảng `interval` giây
+
+    Log vượt quá `rate` bị bỏ và chỉ được đếm; lần log kế tiếp của dòng đó (sang khoảng
+    mới) mang theo số log đã bị lược. Log từ `exempt_level` trở lên luôn được giữ.
+    """
+
+    def __init__(self, rate=5, interval=5.0, exempt_level=logging.ERROR):
+        super().__init__()
+        self.rate = rate
+        self.interval = interval
+        self.exempt_level = exempt_level
+        # (file, dòng) -> [bắt đầu khoảng, số log đã cho qua, số log đã bỏ]
+        self.sites = {}
+        self.lock = Lock()
+
+    def filter(self, record):
+        if record.levelno >= self.exempt_level:
+            return True
+        key = (record.pathname, record.lineno)
+        with self.lock:
+            site = self.sites.get(key)
+            if site is None or record.created - site[0] >= self.interval:
+                suppressed = site[2] if site else 0
+                self.sites[key] = [record.created, 1, 0]
+            elif site[1] < self.rate:
+                site[1] += 1
+                return True
+            else:
+                site[2] += 1
+                return False
+        if suppressed:
+            record.msg = f"{record.getMessage()} (đã lược {suppressed} log tương tự)"
+            record.args = None
+        return True
+
+    def summary(self):
+        """Tổng số log đang bị lược theo từng dòng code (để ghi lại khi thoát)"""
+        with self.lock:
+            return {key: site[2] for key, site in self.sites.items() if site[2]}
+
+
+def setup_logging(level=logging.DEBUG, filename="app.log", rate=5, interval=5.0):
+    """Log qua hàng đợi: thread gọi log chỉ đưa record vào queue, một thread riêng
+    định dạng và ghi ra stdout/file. Log lặp lại trên hot path bị giới hạn bởi RateLimitFilter."""
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [logging.StreamHandler(sys.stdout), logging.FileHandler(filename, encoding="utf-8")]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    rate_limit = RateLimitFilter(rate, interval)
+    queue_handler = QueueHandler(log_queue)
+    # Chỉ ghép message trên thread gọi log; định dạng đầy đủ do thread ghi đảm nhận
+    queue_handler.setFormatter(logging.Formatter("%(message)s"))
+    queue_handler.addFilter(rate_limit)
+    logging.basicConfig(level=level, handlers=[queue_handler])
+    listener.start()
+
+    def shutdown():
+        listener.stop()
+        # Ghi thẳng ra handler (không qua queue/filter) số log còn đang bị lược
+        logger = logging.getLogger(__name__)
+        for (path, lineno), count in rate_limit.summary().items():
+            record = logger.makeRecord(logger.name, logging.INFO, path, lineno,
+                                       f"Đã lược {count} log tại {path}:{lineno}", None, None)
+            for handler in handlers:
+                handler.handle(record)
+
+    atexit.register(shutdown)
+    return listener
@@ -0,0 +1,281 @@
+"""Harness end-to-end trên loopback: host thật (VNC.transmit_loop, InputManager.receive_input,
+Chat.receive_chat) + client headless trong cùng một tiến trình, có thể giả lập đường truyền chậm
+
+Ví dụ:
+    python loopback.py --duration 10
+    python loopback.py --scenario video --latency 80 --bandwidth 4000
+"""
+from threading import Thread, Event
+import argparse
+import queue
+import random
+import socket
+import string
+import time
+import logging
+import framing
+from chat import Chat
+from frame_protocol import unpack_frame
+from frame_sources import StaticDesktop, ScrollingText, VideoPlayback
+from input_manager import InputManager
+from input_protocol import MOUSE_MOVE
+from metrics import Metrics
+from vnc import VNC
+
+logger = logging.getLogger(__name__)
+
+SCENARIOS = {
+    'static': StaticDesktop,
+    'scrolling': ScrollingText,
+    'video': VideoPlayback,
+}
+
+CHUNK_SIZE = 16 * 1024
+
+
+class LinkSimulator:
+    """TCP proxy giả lập đường truyền: độ trễ một chiều và giới hạn băng thông cho mỗi chiều
+
+    Mỗi chiều chỉ đệm tối đa buffer_size byte nên khi link chậm, bên gửi bị chặn
+    như trên mạng thật (ABR của host thấy được thời gian gửi tăng).
+    """
+
+    def __init__(self, target_port, latency=0.0, bandwidth=None, ip='127.0.0.1', buffer_size=256 * 1024):
+        self.target = (ip, target_port)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.buffer_chunks = max(1, buffer_size // CHUNK_SIZE)
+        self.listener = framing.open_listener(ip, 0)
+        self.port = self.listener.getsockname()[1]
+        self.stop_event = Event()
+        self.sockets = []
+
+    def start(self):
+        Thread(target=self.accept_loop, daemon=True).start()
+        return self
+
+    def accept_loop(self):
+        with self.listener:
+            while not self.stop_event.is_set():
+                try:
+                    client, _ = self.listener.accept()
+                except socket.timeout:
+                    continue
+                except OSError:
+                    return
+                client.settimeout(None)
+                server = socket.create_connection(self.target)
+                self.sockets += [client, server]
+                self.pipe(client, server)
+                self.pipe(server, client)
+
+    def pipe(self, source, destination):
+        chunks = queue.Queue(maxsize=self.buffer_chunks)
+        Thread(target=self.read_side, args=[source, chunks], daemon=True).start()
+        Thread(target=self.write_side, args=[destination, chunks], daemon=True).start()
+
+    def read_side(self, source, chunks):
+        link_free_at = 0.0
+        try:
+            while True:
+                data = source.recv(CHUNK_SIZE)
+                if not data:
+                    break
+                now = time.perf_counter()
+                # Thời điểm byte cuối rời link (băng thông) rồi cộng độ trễ lan truyền
+                sent_at = max(now, link_free_at)
+                if self.bandwidth:
+                    sent_at += len(data) / self.bandwidth
+                link_free_at = sent_at
+                chunks.put((sent_at + self.latency, data))
+        except OSError:
+            pass
+        chunks.put(None)
+
+    def write_side(self, destination, chunks):
+        try:
+            while True:
+                item = chunks.get()
+                if item is None:
+                    break
+                deliver_at, data = item
+                delay = deliver_at - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                destination.sendall(data)
+        except OSError:
+            pass
+        try:
+            destination.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+    def close(self):
+        self.stop_event.set()
+        for sock in self.sockets:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+
+class StubInputManager(InputManager):
+    """Input host không điều khiển chuột/phím thật, chỉ đo độ trễ từ lúc client gửi tới lúc inject"""
+
+    def __init__(self, ip, port, sent_at, results):
+        super().__init__(ip, port)
+        self.sent_at = sent_at
+        self.results = results
+
+    def input_controllers(self):
+        return None, None, 1920, 1080
+
+    def inject_event(self, event, mouse_controller, keyboard_controller, width, height):
+        sent = self.sent_at.pop(event.seq, None)
+        if sent is not None:
+            self.results.record('input_latency', time.perf_counter() - sent)
+
+
+def random_secret(length):
+    return ''.join(random.choice(string.ascii_letters + string.digits) for _ in range(length))
+
+
+def send_input(client_input, sent_at, stop_event, rate):
+    """Gửi mouse move đều đặn; seq của event dùng làm khoá tra thời điểm gửi"""
+    step = 0
+    while not stop_event.wait(1.0 / rate):
+        step += 1
+        event = client_input.make_event(MOUSE_MOVE, pos=[(step % 100) / 100, 0.5])
+        sent_at[event.seq] = time.perf_counter()
+        client_input.transmit_events([event])
+
+
+def send_chat(client_chat, stop_event, interval=1.0):
+    while not stop_event.wait(interval):
+        client_chat.send_chat_msg(repr(time.perf_counter()))
+
+
+def receive_frames(client_vnc, results, stop_event):
+    """Client headless: nhận, giải mã, unpack frame và đo độ trễ capture -> nhận"""
+    while not stop_event.is_set():
+        data = client_vnc.recv_msg(client_vnc.reader)
+        if not data:
+            break
+        frame = unpack_frame(data)
+        received = time.time()
+        results.record('frame_bytes', 0, len(data) + framing.HEADER.size)
+        if 'cursor' in frame:
+            results.record('cursor', received - frame['timestamp'], len(data))
+        elif frame['regions']:
+            results.record('frame_latency', received - frame['timestamp'], len(data))
+        else:
+            results.record('keepalive', 0, len(data))
+
+
+def run(scenario='scrolling', duration=10.0, latency=0.0, bandwidth=None, input_rate=60, size=(1920, 1080),
+        base_port=17000, ip='127.0.0.1'):
+    results = Metrics(window=duration)
+    stop_event = Event()
+    password = random_secret(32)
+    nonce = random_secret(16)
+
+    # ---------------- Host ----------------
+    host_vnc = VNC(ip=ip, port=base_port)
+    host_vnc.password, host_vnc.nonce = password, nonce
+    host_vnc.source_factory = lambda: SCENARIOS[scenario](size=size)
+    host_vnc.cursor_factory = None
+
+    sent_at = {}
+    host_input = StubInputManager(ip, base_port + 1, sent_at, results)
+    host_input.key, host_input.nonce = password, nonce
+
+    def on_chat(msg):
+        results.record('chat_latency', time.perf_counter() - float(msg))
+
+    host_chat = Chat(ip, base_port + 2, display_message=on_chat)
+    host_chat.key, host_chat.nonce = password, nonce
+
+    # Listener được mở trước khi client kết nối nên không cần chờ các thread host khởi động
+    listeners = [framing.open_listener(ip, base_port + offset) for offset in range(3)]
+    roles = [
+        (host_vnc.transmit_loop, [stop_event, listeners[0]]),
+        (host_input.receive_input, [stop_event, listeners[1]]),
+        (host_chat.receive_chat, [stop_event, False, listeners[2]]),
+    ]
+    for target, args in roles:
+        Thread(target=target, args=args, daemon=True).start()
+
+    links = [LinkSimulator(base_port + offset, latency, bandwidth, ip).start() for offset in range(3)]
+
+    # ---------------- Client ----------------
+    client_vnc = VNC(ip=ip, port=links[0].port)
+    if not client_vnc.start_receive(password):
+        raise RuntimeError("Client không xác thực được với host")
+    client_input = InputManager(ip, links[1].port)
+    client_input.requestKey, client_input.requestNonce = password, client_vnc.requestNonce
+    client_input.connect_input()
+    client_chat = Chat(ip, links[2].port)
+    client_chat.requestKey, client_chat.requestNonce = password, client_vnc.requestNonce
+    client_chat.connect_chat()
+
+    workers = [
+        Thread(target=receive_frames, args=[client_vnc, results, stop_event], daemon=True),
+        Thread(target=send_input, args=[client_input, sent_at, stop_event, input_rate], daemon=True),
+        Thread(target=send_chat, args=[client_chat, stop_event], daemon=True),
+    ]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    stop_event.wait(duration)
+    elapsed = time.perf_counter() - started
+
+    stop_event.set()
+    for conn in (client_vnc.conn, client_input.conn, client_chat.conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+    for link in links:
+        link.close()
+
+    results.window = elapsed
+    return results.snapshot()
+
+
+def print_report(stages):
+    frames = stages.get('frame_latency', {})
+    total = stages.get('frame_bytes', {})
+    print(f"frame: {frames.get('rate', 0)} fps, {total.get('bytes_rate', 0) * 8 / 1000:.0f} kbit/s")
+    print(f"{'':<16}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'count':>8}")
+    for name in ('frame_latency', 'input_latency', 'chat_latency'):
+        stats = stages.get(name)
+        if stats:
+            print(f"{name:<16}{stats['p50']:>9}{stats['p95']:>9}{stats['p99']:>9}{stats['max']:>9}{stats['count']:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Đo độ trễ và thông lượng end-to-end qua loopback")
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), default='scrolling')
+    parser.add_argument('--duration', type=float, default=10.0, help="giây")
+    parser.add_argument('--latency', type=float, default=0.0, help="độ trễ một chiều (ms)")
+    parser.add_argument('--bandwidth', type=float, help="giới hạn băng thông mỗi chiều (kbit/s)")
+    parser.add_argument('--input-rate', type=float, default=60, help="số mouse move mỗi giây")
+    parser.add_argument('--size', type=int, nargs=2, default=(1920, 1080), metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--base-port', type=int, default=17000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    stages = run(
+        scenario=args.scenario,
+        duration=args.duration,
+        latency=args.latency / 1000,
+        bandwidth=args.bandwidth * 1000 / 8 if args.bandwidth else None,
+        input_rate=args.input_rate,
+        size=tuple(args.size),
+        base_port=args.base_port,
+    )
+    print_report(stages)
+
+
+if __name__ == '__main__':
+    main()
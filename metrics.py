@@ -0,0 +1,92 @@
+from threading import Lock, Thread
+from collections import deque
+import json
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class StageStats:
+    """Thời gian và số byte của một stage trong cửa sổ trượt gần nhất"""
+
+    def __init__(self, max_samples=1000):
+        self.samples = deque(maxlen=max_samples)
+        self.count = 0
+        self.bytes = 0
+
+    def add(self, now, seconds, nbytes):
+        self.samples.append((now, seconds, nbytes))
+        self.count += 1
+        self.bytes += nbytes
+
+    def summary(self, now, window):
+        recent = [(seconds, nbytes) for at, seconds, nbytes in self.samples if now - at <= window]
+        durations = sorted(seconds for seconds, _ in recent)
+
+        def percentile(p):
+            if not durations:
+                return 0.0
+            return round(durations[min(len(durations) - 1, int(p * len(durations)))] * 1000, 2)
+
+        return {
+            'count': self.count,
+            'bytes': self.bytes,
+            'rate': round(len(recent) / window, 1),
+            'bytes_rate': int(sum(nbytes for _, nbytes in recent) / window),
+            'p50': percentile(0.5),
+            'p95': percentile(0.95),
+            'p99': percentile(0.99),
+            'max': round(durations[-1] * 1000, 2) if durations else 0.0,
+        }
+
+
+class Metrics:
+    """Bộ đếm thời gian/byte theo stage (capture, resize, encode, encrypt, send, ...)
+
+    record() đủ rẻ để gọi trên mọi frame; snapshot() tính percentile (ms) và tốc độ
+    (lần/s, byte/s) trên các mẫu trong `window` giây gần nhất.
+    """
+
+    def __init__(self, window=5.0):
+        self.window = window
+        self.stages = {}
+        self.lock = Lock()
+
+    def record(self, stage, seconds, nbytes=0):
+        now = time.monotonic()
+        with self.lock:
+            stats = self.stages.get(stage)
+            if stats is None:
+                stats = self.stages[stage] = StageStats()
+            stats.add(now, seconds, nbytes)
+
+    def reset(self):
+        with self.lock:
+            self.stages = {}
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self.lock:
+            return {stage: stats.summary(now, self.window) for stage, stats in self.stages.items()}
+
+    def dump(self, path):
+        """Ghi thêm một dòng JSON (thời điểm + snapshot) vào file"""
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'time': time.time(), 'stages': self.snapshot()}) + '\n')
+
+    def start_dump(self, path, interval, stop_event):
+        def dump_loop():
+            while not stop_event.wait(interval):
+                try:
+                    self.dump(path)
+                except Exception as e:
+                    logger.error(f"Lỗi ghi file thống kê {path}: {e}")
+
+        thread = Thread(target=dump_loop, daemon=True)
+        thread.start()
+        return thread
+
+
+# Dùng chung cho cả tiến trình: host và client ghi vào đây, UI đọc qua get_stats()
+metrics = Metrics()
@@ -0,0 +1,275 @@
+from threading import Thread, Condition, Event
+from collections import deque
+import queue
+import socket
+import struct
+import logging
+import framing
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_VIDEO = 1
+CHANNEL_INPUT = 2
+CHANNEL_CHAT = 3
+
+# Kênh đứng trước được gửi trước: input luôn chen lên trước video đang chờ
+PRIORITY = (CHANNEL_INPUT, CHANNEL_CHAT, CHANNEL_VIDEO)
+
+# Fragment: kênh, độ dài payload
+FRAGMENT = struct.Struct('>BI')
+FRAGMENT_SIZE = 16 * 1024
+# Số fragment tối đa chờ trong một kênh; host đọc input/chat của từng kết nối trên thread riêng
+# nên chỉ peer gửi dồn (hoặc gửi trước khi xác thực) mới chạm ngưỡng và bị đóng kết nối
+MAX_INBOUND_FRAGMENTS = 1024
+
+
+class Channel:
+    """Socket ảo của một kênh trên kết nối mux (sendall / recv / recv_into / close)
+
+    Mỗi kênh vẫn chạy handshake và cipher session riêng như khi dùng socket thật,
+    mux chỉ chuyển các byte đã mã hoá.
+    """
+
+    def __init__(self, mux, channel_id):
+        self.mux = mux
+        self.channel_id = channel_id
+        self.inbound = deque()
+        self.cond = Condition()
+        self.eof = False
+        self.timeout = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def sendall(self, data):
+        self.mux.write(self.channel_id, data)
+
+    def settimeout(self, timeout):
+        """Như socket.settimeout: recv ném socket.timeout nếu chờ quá timeout giây (None => chờ mãi)"""
+        self.timeout = timeout
+
+    def recv_into(self, view, nbytes=0):
+        nbytes = nbytes or len(view)
+        with self.cond:
+            while not self.inbound and not self.eof:
+                if not self.cond.wait(self.timeout):
+                    raise socket.timeout("timed out")
+            if not self.inbound:
+                return 0
+            chunk = self.inbound[0]
+            count = min(nbytes, len(chunk))
+            view[:count] = chunk[:count]
+            if count == len(chunk):
+                self.inbound.popleft()
+            else:
+                self.inbound[0] = chunk[count:]
+            return count
+
+    def recv(self, bufsize):
+        data = bytearray(bufsize)
+        count = self.recv_into(memoryview(data), bufsize)
+        return bytes(data[:count])
+
+    def feed(self, data):
+        with self.cond:
+            if len(self.inbound) >= MAX_INBOUND_FRAGMENTS:
+                raise ValueError(f"Kênh mux {self.channel_id} đầy, peer gửi quá nhanh")
+            self.inbound.append(memoryview(data))
+            self.cond.notify()
+
+    def close_inbound(self):
+        with self.cond:
+            self.eof = True
+            self.cond.notify_all()
+
+    def mark_authenticated(self):
+        """Kênh video đã xác thực mật khẩu: host mới bắt đầu phục vụ các kênh còn lại"""
+        self.mux.authenticated.set()
+
+    def close(self):
+        # Các kênh dùng chung một kết nối nên đóng một kênh là đóng cả phiên
+        self.mux.close()
+
+
+class MuxConnection:
+    """Ghép kênh video, input và chat trên một kết nối TCP"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.channels = {channel_id: Channel(self, channel_id) for channel_id in PRIORITY}
+        self.outbound = {channel_id: deque() for channel_id in PRIORITY}
+        self.cond = Condition()
+        self.closed = False
+        self.authenticated = Event()
+        Thread(target=self.write_loop, daemon=True).start()
+        Thread(target=self.read_loop, daemon=True).start()
+
+    def channel(self, channel_id):
+        return self.channels[channel_id]
+
+    def write(self, channel_id, data):
+        """Chia message thành fragment và chờ tới khi ghi xong (giữ backpressure cho caller)"""
+        view = memoryview(data)
+        done = Event()
+        with self.cond:
+            if self.closed:
+                raise BrokenPipeError("Kết nối mux đã đóng")
+            fragments = self.outbound[channel_id]
+            for offset in range(0, len(view), FRAGMENT_SIZE):
+                fragments.append((view[offset:offset + FRAGMENT_SIZE], None))
+            fragments.append((memoryview(b''), done))
+            self.cond.notify()
+        done.wait()
+        if self.closed:
+            raise BrokenPipeError("Kết nối mux đã đóng")
+
+    def next_fragment(self):
+        with self.cond:
+            while not self.closed:
+                for channel_id in PRIORITY:
+                    if self.outbound[channel_id]:
+                        fragment, done = self.outbound[channel_id].popleft()
+                        return channel_id, fragment, done
+                self.cond.wait()
+            return None
+
+    def write_loop(self):
+        try:
+            while True:
+                item = self.next_fragment()
+                if item is None:
+                    return
+                channel_id, fragment, done = item
+                if done:
+                    done.set()
+                    continue
+                self.sock.sendall(FRAGMENT.pack(channel_id, len(fragment)) + fragment)
+        except Exception as e:
+            logger.warning(f"Lỗi ghi kết nối mux: {e}")
+        finally:
+            self.close()
+
+    def read_loop(self):
+        header = bytearray(FRAGMENT.size)
+        try:
+            while framing.recv_exact(self.sock, memoryview(header)):
+                channel_id, length = FRAGMENT.unpack(header)
+                # Kiểm tra trước khi cấp phát: header đến từ peer chưa xác thực
+                channel = self.channels.get(channel_id)
+                if channel is None:
+                    raise ValueError(f"Kênh mux không hợp lệ: {channel_id}")
+                if length > FRAGMENT_SIZE:
+                    raise ValueError(f"Fragment mux quá lớn: {length} byte")
+                payload = bytearray(length)
+                if not framing.recv_exact(self.sock, memoryview(payload)):
+                    break
+                channel.feed(payload)
+        except Exception as e:
+            logger.warning(f"Lỗi đọc kết nối mux: {e}")
+        finally:
+            self.close()
+
+    def close(self):
+        with self.cond:
+            if self.closed:
+                return
+            self.closed = True
+            for fragments in self.outbound.values():
+                for _, done in fragments:
+                    if done:
+                        done.set()
+                fragments.clear()
+            self.cond.notify_all()
+        for channel in self.channels.values():
+            channel.close_inbound()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+def connect(ip, port):
+    """Client mở một kết nối mux tới host"""
+    sock = socket.create_connection((ip, port))
+    return MuxConnection(sock)
+
+
+class ChannelListener:
+    """Giả lập listener socket cho một kênh: accept() trả về Channel của kết nối mux mới"""
+
+    def __init__(self):
+        self.pending = queue.Queue()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def push(self, channel, addr):
+        self.pending.put((channel, addr))
+
+    def accept(self):
+        try:
+            return self.pending.get(timeout=0.5)
+        except queue.Empty:
+            raise socket.timeout()
+
+    def close(self):
+        # Socket thật do MuxListener giữ
+        pass
+
+
+class MuxListener:
+    """Host nhận kết nối mux trên một port và phân phối từng kênh cho VNC, input, chat
+
+    Kênh có handler (handler(channel, addr, stop_event)) được phục vụ trên thread riêng của
+    từng kết nối, sau khi kênh video của kết nối đó xác thực xong; kênh còn lại đi qua
+    ChannelListener như socket lắng nghe thường.
+    """
+
+    def __init__(self, ip='0.0.0.0', port=7002, handlers=None):
+        self.ip = ip
+        self.port = port
+        self.handlers = handlers or {}
+        self.listeners = {channel_id: ChannelListener() for channel_id in PRIORITY if channel_id not in self.handlers}
+
+    def listener(self, channel_id):
+        return self.listeners[channel_id]
+
+    def serve(self, stop_event):
+        try:
+            listener = framing.open_listener(self.ip, self.port)
+        except Exception as e:
+            logger.error(f"Lỗi khi bind/listen mux: {e}")
+            return
+        logger.info(f"Mux server đang chạy tại {self.ip}:{self.port}")
+        with listener:
+            while not stop_event.is_set():
+                try:
+                    conn, addr = listener.accept()
+                except socket.timeout:
+                    continue
+                except Exception as e:
+                    logger.error(f"Lỗi accept mux: {e}")
+                    return
+                conn.settimeout(None)
+                logger.info(f"Kết nối mux mới: {addr}")
+                mux = MuxConnection(conn)
+                for channel_id, channel_listener in self.listeners.items():
+                    channel_listener.push(mux.channel(channel_id), addr)
+                if self.handlers:
+                    Thread(target=self.dispatch, args=[mux, addr, stop_event], daemon=True).start()
+
+    def dispatch(self, mux, addr, stop_event):
+        """Chờ kênh video xác thực rồi chạy handler cho từng kênh còn lại của kết nối"""
+        while not mux.authenticated.wait(0.5):
+            if mux.closed or stop_event.is_set():
+                return
+        for channel_id, handler in self.handlers.items():
+            Thread(target=handler, args=[mux.channel(channel_id), addr, stop_event], daemon=True).start()
@@ -0,0 +1,199 @@
+from threading import Thread, Event, Condition, Lock
+import queue
+import time
+import logging
+from frame_protocol import FRAME_KEY, CODEC_COPY
+
+logger = logging.getLogger(__name__)
+
+
+class LatestQueue:
+    """Hàng đợi một phần tử: put() ghi đè phần tử chưa được lấy (latest-frame-wins)"""
+
+    def __init__(self):
+        self.cond = Condition()
+        self.item = None
+        self.has_item = False
+        self.dropped = 0
+
+    def put(self, item):
+        """Trả về True nếu phần tử cũ chưa được lấy đã bị bỏ"""
+        with self.cond:
+            replaced = self.has_item
+            if replaced:
+                self.dropped += 1
+            self.item = item
+            self.has_item = True
+            self.cond.notify()
+            return replaced
+
+    def get(self, timeout=None):
+        with self.cond:
+            if not self.has_item:
+                self.cond.wait(timeout)
+            if not self.has_item:
+                return None
+            item = self.item
+            self.item = None
+            self.has_item = False
+            return item
+
+
+class LatestFrame:
+    """Frame mới nhất chờ hiển thị ở client (latest-frame-wins cho luồng keyframe + delta)
+
+    Delta không được bỏ vì phụ thuộc frame trước, nên frame mới được gộp vào frame
+    đang chờ: region mới đè lên region cùng vị trí, keyframe thay thế toàn bộ.
+    Copy-rect đọc lại màn hình nên là rào chắn: region sau nó không đè region trước nó.
+    Payload được copy vì unpack_frame trả về view vào buffer đọc dùng lại.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.pending = None
+        # Số copy-rect trong frame đang chờ; là một phần khoá của region để gộp theo rào chắn
+        self.generation = 0
+        self.cursor = None
+        self.closed = False
+        self.merged = 0
+
+    def put(self, frame):
+        if 'cursor' in frame:
+            # Con trỏ độc lập với frame: chỉ giữ vị trí mới nhất
+            with self.lock:
+                self.cursor = frame['cursor']
+            return
+        regions = [region._replace(data=bytes(region.data)) for region in frame['regions']]
+        with self.lock:
+            pending = self.pending
+            if pending is None or frame['type'] == FRAME_KEY:
+                self.pending = dict(frame, regions={})
+                self.generation = 0
+                if pending is not None:
+                    self.merged += 1
+            else:
+                # Giữ loại frame đang chờ (keyframe gộp delta vẫn là keyframe)
+                pending.update(id=frame['id'], size=frame['size'], timestamp=frame['timestamp'])
+                self.merged += 1
+            merged = self.pending['regions']
+            for region in regions:
+                if region.codec == CODEC_COPY:
+                    self.generation += 1
+                    key = (self.generation, 'copy')
+                else:
+                    key = (self.generation, region.x, region.y, region.width, region.height)
+                merged.pop(key, None)
+                merged[key] = region
+
+    def take(self):
+        """Lấy frame đang chờ (không chặn); None nếu chưa có frame mới"""
+        with self.lock:
+            frame = self.pending
+            self.pending = None
+        if frame is None:
+            return None
+        return dict(frame, regions=list(frame['regions'].values()))
+
+    def take_cursor(self):
+        with self.lock:
+            cursor = self.cursor
+            self.cursor = None
+        return cursor
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+
+
+class FramePipeline:
+    """Capture -> encode -> send, mỗi stage chạy trên worker riêng
+
+    Giữa capture và encode là LatestQueue: ảnh thô bị bỏ khi encoder bận là vô hại.
+    Giữa encode và send là hàng đợi có giới hạn nhưng không bỏ phần tử, vì delta
+    đã mã hoá phụ thuộc vào frame trước nên không được phép rơi mất.
+    """
+
+    def __init__(self, source, encode, send, stop_event, max_fps=30, send_queue_size=2, controller=None):
+        self.source = source
+        self.encode = encode
+        self.send = send
+        self.stop_event = stop_event
+        self.max_fps = max_fps
+        self.controller = controller
+        self.raw_frames = LatestQueue()
+        self.encoded_frames = queue.Queue(maxsize=send_queue_size)
+        self.stopped = Event()
+
+    def running(self):
+        return not (self.stopped.is_set() or self.stop_event.is_set())
+
+    def frame_interval(self):
+        fps = self.controller.fps if self.controller else self.max_fps
+        return 1.0 / fps
+
+    # ---------------- Stages ----------------
+
+    def capture_stage(self):
+        try:
+            with self.source as source:
+                while self.running():
+                    started = time.perf_counter()
+                    try:
+                        image = source.grab()
+                        if image is not None:
+                            self.raw_frames.put((image, started))
+                    except Exception as e:
+                        logger.error(f"Lỗi stage capture: {e}")
+                    delay = self.frame_interval() - (time.perf_counter() - started)
+                    if delay > 0:
+                        self.stopped.wait(delay)
+        except Exception as e:
+            logger.error(f"Không mở được nguồn capture: {e}")
+            self.stopped.set()
+
+    def encode_stage(self):
+        while self.running():
+            item = self.raw_frames.get(timeout=0.1)
+            if item is None:
+                continue
+            image, captured_at = item
+            try:
+                data = self.encode(image)
+            except Exception as e:
+                logger.error(f"Lỗi stage encode: {e}")
+                continue
+            if data is None:
+                continue
+            while self.running():
+                try:
+                    self.encoded_frames.put((data, captured_at), timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+
+    def send_stage(self):
+        while self.running():
+            try:
+                data, captured_at = self.encoded_frames.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            self.send(data)
+
+    # ---------------- Lifecycle ----------------
+
+    def run(self):
+        """Chạy pipeline, send stage chạy trên thread gọi; ném lại lỗi gửi để caller xử lý ngắt kết nối"""
+        workers = [
+            Thread(target=self.capture_stage, daemon=True),
+            Thread(target=self.encode_stage, daemon=True),
+        ]
+        for worker in workers:
+            worker.start()
+        try:
+            self.send_stage()
+        finally:
+            self.stopped.set()
+            for worker in workers:
+                worker.join(timeout=1)
+            if self.raw_frames.dropped:
+                logger.debug(f"Pipeline đã bỏ {self.raw_frames.dropped} frame thô")
@@ -0,0 +1,228 @@
+"""Ghi lại phiên host thành file nhỏ gọn và phát lại có tua nhanh
+
+File .vrec chỉ ghi nối (append-only): header FILE_MAGIC rồi tới các record, mỗi record là
+độ dài (RECORD) + message đã pack_frame/pack_cursor, đúng bytes host gửi cho viewer (trước
+khi mã hoá) nên việc ghi không phải encode lại gì. File .idx đi kèm ghi (timestamp, offset)
+của từng keyframe; thiếu hoặc hỏng thì player dựng lại bằng cách quét header các record.
+
+Ví dụ:
+    python recording.py info session.vrec
+    python recording.py snapshot session.vrec --at 12.5 frame.png
+"""
+from PIL import Image
+from threading import Thread
+from bisect import bisect_right
+from io import BytesIO
+import argparse
+import mmap
+import queue
+import struct
+import logging
+from frame_protocol import HEADER, COPY, CODEC_COPY, FRAME_KEY, FRAME_DELTA, is_keyframe, unpack_frame
+
+logger = logging.getLogger(__name__)
+
+FILE_MAGIC = b'VREC\x01'
+# Độ dài message theo sau
+RECORD = struct.Struct('>I')
+# Mục index: timestamp của keyframe, offset record trong file .vrec
+INDEX = struct.Struct('>dQ')
+
+
+def index_path(path):
+    return path + '.idx'
+
+
+class SessionRecorder:
+    """Ghi luồng frame đã mã hoá của host ra đĩa trên thread riêng
+
+    write() chỉ đưa bytes vào hàng đợi nên gần như không tốn gì trên hot path. Bản ghi
+    luôn bắt đầu bằng keyframe; nếu hàng đợi đầy (đĩa chậm) thì bỏ frame và chờ keyframe
+    kế tiếp, on_gap được gọi để encoder tạo keyframe sớm (VD: tile_encoder.request_keyframe).
+    """
+
+    def __init__(self, path, on_gap=None, queue_size=256):
+        self.path = path
+        self.on_gap = on_gap
+        self.records = queue.Queue(maxsize=queue_size)
+        self.waiting_keyframe = True
+        self.dropped = 0
+        self.closed = False
+        self.file = open(path, 'ab')
+        self.index = open(index_path(path), 'ab')
+        if self.file.tell() == 0:
+            self.file.write(FILE_MAGIC)
+        self.writer = Thread(target=self.write_loop, daemon=True)
+        self.writer.start()
+        logger.info(f"Đang ghi phiên vào {path}")
+
+    def write(self, data, frame=True):
+        """Ghi một message; frame=False cho message độc lập với keyframe (con trỏ)"""
+        if self.closed:
+            return
+        if frame and self.waiting_keyframe:
+            if not is_keyframe(data):
+                if self.on_gap:
+                    self.on_gap()
+                return
+            self.waiting_keyframe = False
+        try:
+            self.records.put_nowait(data)
+        except queue.Full:
+            self.dropped += 1
+            if frame:
+                # Delta sau chỗ hổng không giải mã được: bỏ tới keyframe kế tiếp
+                self.waiting_keyframe = True
+                if self.on_gap:
+                    self.on_gap()
+
+    def write_loop(self):
+        while True:
+            data = self.records.get()
+            if data is None:
+                break
+            try:
+                offset = self.file.tell()
+                self.file.write(RECORD.pack(len(data)))
+                self.file.write(data)
+                if is_keyframe(data):
+                    self.index.write(INDEX.pack(HEADER.unpack_from(data, 0)[7], offset))
+                    # Đẩy xuống đĩa theo nhịp keyframe: mất điện chỉ mất đoạn cuối
+                    self.file.flush()
+                    self.index.flush()
+            except OSError as e:
+                logger.error(f"Lỗi ghi bản ghi phiên: {e}")
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.records.put(None)
+        self.writer.join(timeout=5)
+        self.file.close()
+        self.index.close()
+        if self.dropped:
+            logger.warning(f"Bản ghi {self.path} đã bỏ {self.dropped} message do ghi đĩa không kịp")
+
+
+class SessionPlayer:
+    """Đọc file .vrec qua mmap: không nạp cả bản ghi vào RAM, payload là view vào file
+
+    seek(t) trả về offset của keyframe gần nhất trước t; frames(offset) duyệt các message
+    từ đó theo thứ tự ghi.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(FILE_MAGIC)) != FILE_MAGIC:
+                raise ValueError(f"{path} không phải bản ghi phiên")
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.size = len(self.map)
+        self.keyframes = self.load_index()
+        if not self.keyframes:
+            raise ValueError(f"{path} không có keyframe nào")
+        self.times = [timestamp for timestamp, _ in self.keyframes]
+
+    def load_index(self):
+        try:
+            with open(index_path(self.path), 'rb') as f:
+                data = f.read()
+        except OSError:
+            data = b''
+        count = len(data) // INDEX.size
+        keyframes = [INDEX.unpack_from(data, i * INDEX.size) for i in range(count)]
+        # Mục index trỏ quá cuối file (ghi dở khi crash) => không tin index, quét lại
+        if keyframes and all(offset + RECORD.size <= self.size for _, offset in keyframes):
+            return keyframes
+        return self.scan()
+
+    def scan(self):
+        """Dựng index từ header các record; chỉ đọc vài chục byte mỗi record"""
+        keyframes = []
+        for offset, data in self.records(len(FILE_MAGIC)):
+            if is_keyframe(data):
+                keyframes.append((HEADER.unpack_from(data, 0)[7], offset))
+        return keyframes
+
+    def records(self, offset):
+        """(offset, message) từ offset; dừng ở record cuối bị ghi dở"""
+        view = memoryview(self.map)
+        while offset + RECORD.size <= self.size:
+            (length,) = RECORD.unpack_from(self.map, offset)
+            end = offset + RECORD.size + length
+            if end > self.size:
+                break
+            yield offset, view[offset + RECORD.size:end]
+            offset = end
+
+    @property
+    def start_time(self):
+        return self.times[0]
+
+    @property
+    def end_time(self):
+        return max(HEADER.unpack_from(data, 0)[7] for _, data in self.records(self.keyframes[-1][1]))
+
+    def seek(self, timestamp):
+        """Offset của keyframe cuối cùng có timestamp <= timestamp (hoặc keyframe đầu)"""
+        position = max(0, bisect_right(self.times, timestamp) - 1)
+        return self.keyframes[position][1]
+
+    def frames(self, offset=None):
+        """Các frame đã unpack_frame từ offset (mặc định: keyframe đầu tiên)"""
+        for _, data in self.records(self.keyframes[0][1] if offset is None else offset):
+            yield unpack_frame(data)
+
+    def render(self, timestamp):
+        """Ảnh màn hình tại timestamp: giải mã từ keyframe gần nhất rồi áp các delta tới đó"""
+        screen = None
+        for frame in self.frames(self.seek(timestamp)):
+            if frame['timestamp'] > timestamp and screen is not None:
+                break
+            if frame['type'] == FRAME_KEY:
+                screen = Image.new('RGB', frame['size'])
+            elif frame['type'] != FRAME_DELTA or screen is None:
+                continue
+            apply_regions(screen, frame['regions'])
+        return screen
+
+    def close(self):
+        self.map.close()
+
+
+def apply_regions(screen, regions):
+    """Vẽ các region lên ảnh theo thứ tự như client (copy-rect đọc lại chính ảnh)"""
+    for region in regions:
+        if region.codec == CODEC_COPY:
+            x, y = COPY.unpack(region.data)
+            screen.paste(screen.crop((x, y, x + region.width, y + region.height)), (region.x, region.y))
+        else:
+            screen.paste(Image.open(BytesIO(region.data)).convert('RGB'), (region.x, region.y))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Xem thông tin và trích ảnh từ bản ghi phiên")
+    commands = parser.add_subparsers(dest='command', required=True)
+    info = commands.add_parser('info')
+    info.add_argument('path')
+    snapshot = commands.add_parser('snapshot', help="lưu màn hình tại một thời điểm ra file ảnh")
+    snapshot.add_argument('path')
+    snapshot.add_argument('output')
+    snapshot.add_argument('--at', type=float, default=0.0, help="giây tính từ đầu bản ghi")
+    args = parser.parse_args()
+
+    player = SessionPlayer(args.path)
+    try:
+        if args.command == 'info':
+            count = sum(1 for _ in player.records(len(FILE_MAGIC)))
+            print(f"{args.path}: {player.size} bytes, {count} message, {len(player.keyframes)} keyframe, "
+                  f"{player.end_time - player.start_time:.1f} giây")
+        else:
+            player.render(player.start_time + args.at).save(args.output)
+    finally:
+        player.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -5,14 +5,64 @@ import mss
 import base64
 import struct
 import time
+import os
 import logging
 import chacha20_util
+import framing
+from frame_codec import TileEncoder
+from frame_protocol import pack_frame, pack_cursor, unpack_frame, FRAME_KEY
+from cursor import CursorTracker
+from capture_area import CaptureArea
+from pipeline import FramePipeline
+from bitrate import BitrateController
+from broadcast import Broadcaster
+from metrics import metrics
+from threading import Thread, Event, Lock
 
 logger = logging.getLogger(__name__)
 
+class ScreenSource:
+    """Nguồn chụp màn hình bằng mss, giữ một context mss suốt vòng đời thread capture
+
+    grab() trả về đúng object ảnh của lần trước nếu bytes thô không đổi: so sánh bytes
+    (memcmp) rẻ hơn nhiều so với convert rồi diff ảnh, và bỏ qua luôn bước convert.
+    """
+
+    def __init__(self, monitor=1, area=None):
+        self.monitor = monitor
+        self.area = area
+        self.sct = None
+        self.last_raw = None
+        self.last_image = None
+
+    def __enter__(self):
+        self.sct = mss.mss()
+        return self
+
+    def __exit__(self, *exc):
+        self.sct.close()
+        self.sct = None
+        self.last_raw = None
+        self.last_image = None
+
+    def grab(self):
+        started = time.perf_counter()
+        rect = self.area.resolve(self.sct.monitors) if self.area else self.sct.monitors[self.monitor]
+        img = self.sct.grab(rect)
+        raw = img.bgra
+        captured = time.perf_counter()
+        metrics.record('capture', captured - started, len(raw))
+        if self.last_image is None or raw != self.last_raw:
+            self.last_raw = raw
+            self.last_image = Image.frombytes('RGB', img.size, raw, 'raw', 'BGRX')
+            metrics.record('convert', time.perf_counter() - captured)
+        # Thời điểm chụp đi theo frame (timestamp trong header) để đo độ trễ capture -> client
+        self.last_image.info['captured_at'] = time.time()
+        return self.last_image
+
 class VNC:
 
-    def __init__(self, ip='0.0.0.0', port=7000, open_chat_window=None, disconnect_chat=None):
+    def __init__(self, ip='0.0.0.0', port=7000, open_chat_window=None, disconnect_chat=None, delta_encoding=True, max_viewers=1, encode_workers=None):
         self.ip = ip
         self.port = port
         self.conn = None
@@ -20,16 +70,63 @@ class VNC:
         self.nonce = ''
         self.requestPassword = ''
         self.requestNonce = ''
+        self.session = None
+        self.reader = None
         self.open_chat_window = open_chat_window
         self.disconnect_chat = disconnect_chat
+        # Khung tối đa của frame gửi đi khi client chưa báo viewport (set_viewport)
+        self.resolution = (1800, 900)
+        # Frame nhỏ hơn ảnh chụp không quá tỉ lệ này thì gửi nguyên kích thước (trình duyệt tự thu nhỏ);
+        # chỉ áp dụng khi bitrate controller chưa giảm độ phân giải, để bước giảm đầu tiên vẫn có tác dụng
+        self.native_threshold = 0.9
+        self.max_fps = 30
+        self.max_viewers = max_viewers
+        # Thời gian tối đa (giây) cho client gửi xong salt + mật khẩu; xác thực chạy trên thread
+        # accept nên client treo không được giữ chân viewer khác
+        self.auth_timeout = 5.0
+        # Monitor / vùng con do client chọn, dùng chung với InputManager và CursorTracker
+        self.capture_area = CaptureArea()
+        # Nguồn frame cho phiên remote; thay bằng nguồn tổng hợp (frame_sources) khi chạy không có màn hình
+        self.source_factory = lambda: ScreenSource(area=self.capture_area)
+        # Con trỏ chuột được gửi thành message riêng (mss không vẽ con trỏ vào ảnh chụp) nên
+        # di chuột không làm encode lại frame; None => tắt
+        self.cursor_factory = lambda: CursorTracker(area=self.capture_area)
+        # Tạo SessionRecorder cho mỗi phiên remote (viewer đầu tiên tới khi viewer cuối rời đi) để
+        # ghi lại luồng frame đã mã hoá, kể cả con trỏ; None => không ghi
+        self.recorder_factory = None
+        # Recorder của các phiên đang ghi; mỗi phiên giữ recorder riêng, tập này chỉ để đóng khi thoát app
+        self.recorders = set()
+        self.recorders_lock = Lock()
+        self.cursor_interval = 1 / 60
+        self.cursor_state = None
+        self.cursor_sent_at = 0
+        self.cursor_id = 0
+        self.bitrate = BitrateController(base_resolution=self.resolution, max_fps=self.max_fps)
+        # keyframe_interval=0 => mọi frame đều là keyframe (tắt delta)
+        # encode_workers=1 => mã hoá tuần tự trên một thread; mặc định dùng mọi core (tối đa 8)
+        if encode_workers is None:
+            encode_workers = min(8, os.cpu_count() or 1)
+        self.tile_encoder = TileEncoder(keyframe_interval=120 if delta_encoding else 0, workers=encode_workers)
+        # Frame vừa chụp và scale cho phiên remote; preview local dùng lại thay vì tự chụp
+        self.latest_frame = None
+        self.latest_frame_at = 0
+        self.latest_frame_number = 0
+        self.latest_lock = Lock()
+        self.preview_number = None
+        # Màn hình đứng yên: không encode/gửi, chỉ gửi keepalive (delta rỗng) mỗi keepalive_interval
+        # giây và gửi lại keyframe sau max_idle_refresh giây (0 => không refresh)
+        self.keepalive_interval = 1.0
+        self.max_idle_refresh = 30.0
+        self.last_capture = None
+        self.idle_since = 0
+        self.last_sent_at = 0
 
     # ---------------- Screenshot helpers ----------------
 
     def screenshot(self):
         try:
-            with mss.mss() as sct:
-                img = sct.grab(sct.monitors[1])
-            return self.rgba_to_rgb(img)
+            with ScreenSource(area=self.capture_area) as source:
+                return source.grab()
         except Exception as e:
             logger.error(f"Lỗi khi chụp màn hình: {e}")
             return None
@@ -46,7 +143,7 @@ class VNC:
             image = self.screenshot()
             if image is None:
                 return None
-            image = image.resize(resolution, Image.Resampling.LANCZOS)
+            image = self.tile_encoder.resize(image, resolution)
             buffer = BytesIO()
             image.save(buffer, format='jpeg')
             data_string = base64.b64encode(buffer.getvalue())
@@ -56,6 +153,161 @@ class VNC:
             logger.error(f"Lỗi serialize ảnh: {e}")
             return None
 
+    def publish_frame(self, image):
+        with self.latest_lock:
+            self.latest_frame = image
+            self.latest_frame_at = time.monotonic()
+            self.latest_frame_number += 1
+
+    def preview_serializer(self, resolution=(900, 450), max_age=0.5):
+        """Ảnh preview (base64) cho UI host
+
+        Trong phiên remote, dùng lại frame mà pipeline vừa chụp và scale nên màn hình chỉ
+        bị chụp một lần cho cả hai; trả về None nếu chưa có frame mới kể từ lần preview trước.
+        Khi không có phiên (hoặc frame đã cũ quá max_age giây) thì tự chụp như image_serializer.
+        """
+        with self.latest_lock:
+            image = self.latest_frame
+            fresh = image is not None and time.monotonic() - self.latest_frame_at <= max_age
+            number = self.latest_frame_number
+        if not fresh:
+            self.preview_number = None
+            return self.image_serializer(resolution)
+        if number == self.preview_number:
+            return None
+        self.preview_number = number
+        try:
+            image = image.resize(resolution, Image.Resampling.BILINEAR)
+            buffer = BytesIO()
+            image.save(buffer, format='jpeg')
+            return base64.b64encode(buffer.getvalue())
+        except Exception as e:
+            logger.error(f"Lỗi serialize preview: {e}")
+            return None
+
+    def skip_idle(self, image, now):
+        """True nếu ảnh chụp không đổi so với lần trước và không cần encode lại"""
+        if image is not self.last_capture:
+            self.last_capture = image
+            self.idle_since = now
+            return False
+        if self.tile_encoder.force_keyframe or self.tile_encoder.previous is None:
+            # Viewer mới hoặc viewer vừa bị bỏ frame đang chờ keyframe
+            return False
+        if self.max_idle_refresh and now - self.idle_since >= self.max_idle_refresh:
+            self.idle_since = now
+            self.tile_encoder.request_keyframe()
+            return False
+        return True
+
+    def encode_frame(self, image, recorder=None):
+        """Mã hoá ảnh đã chụp thành keyframe hoặc delta gồm các tile thay đổi
+
+        Trả về None khi màn hình đứng yên và chưa tới lúc gửi keepalive. Frame được ghi
+        vào recorder của phiên nếu có.
+        """
+        now = time.monotonic()
+        if self.skip_idle(image, now):
+            # Frame preview vẫn đúng với màn hình, chỉ cần làm mới thời điểm
+            with self.latest_lock:
+                self.latest_frame_at = now
+            if now - self.last_sent_at < self.keepalive_interval:
+                return None
+            self.last_sent_at = now
+            return pack_frame(self.tile_encoder.keepalive())
+        self.last_sent_at = now
+        captured_at = image.info.get('captured_at')
+        started = time.perf_counter()
+        image = self.tile_encoder.resize(image, self.output_size(image.size))
+        resized = time.perf_counter()
+        metrics.record('resize', resized - started)
+        self.publish_frame(image)
+        self.tile_encoder.quality = self.bitrate.quality
+        frame = self.tile_encoder.encode(image, timestamp=captured_at)
+        data = pack_frame(frame)
+        if recorder:
+            recorder.write(data)
+        metrics.record('encode', time.perf_counter() - resized, len(data))
+        frame_type = 'key' if frame['type'] == FRAME_KEY else 'delta'
+        logger.debug(f"Đã serialize frame {frame['id']} {frame_type} ({len(frame['regions'])} region, {len(data)} bytes)")
+        return data
+
+    def set_viewport(self, width, height, pixel_ratio=1.0):
+        """Client báo kích thước vùng hiển thị (CSS pixel) và devicePixelRatio; nhiều viewer thì báo sau cùng thắng"""
+        viewport = (max(2, round(width * pixel_ratio)), max(2, round(height * pixel_ratio)))
+        if viewport != self.bitrate.base_resolution:
+            logger.info(f"Viewport client: {width}x{height} @{pixel_ratio} => khung {viewport[0]}x{viewport[1]}")
+            self.bitrate.base_resolution = viewport
+            # Màn hình đứng yên thì skip_idle bỏ qua encode; keyframe buộc gửi ngay kích thước mới
+            self.tile_encoder.request_keyframe()
+
+    def output_size(self, size):
+        """Kích thước frame: ảnh chụp thu nhỏ vừa khung bitrate.resolution, giữ tỉ lệ và không phóng to"""
+        width, height = size
+        box_width, box_height = self.bitrate.resolution
+        scale = min(box_width / width, box_height / height)
+        if scale >= 1 or (self.bitrate.scale >= self.bitrate.max_scale and scale >= self.native_threshold):
+            return size
+        return (max(2, round(width * scale)) & ~1, max(2, round(height * scale)) & ~1)
+
+    def open_recorder(self):
+        """Mở file ghi cho phiên mới (gọi trước frame đầu tiên của phiên); None nếu không ghi"""
+        if self.recorder_factory is None:
+            return None
+        try:
+            recorder = self.recorder_factory()
+        except Exception as e:
+            logger.error(f"Không mở được file ghi phiên: {e}")
+            return None
+        with self.recorders_lock:
+            self.recorders.add(recorder)
+        return recorder
+
+    def close_recorder(self, recorder):
+        if recorder is None:
+            return
+        with self.recorders_lock:
+            self.recorders.discard(recorder)
+        recorder.close()
+
+    def stop_recording(self):
+        """Đóng mọi file ghi còn mở, VD: thoát app giữa phiên"""
+        with self.recorders_lock:
+            recorders, self.recorders = list(self.recorders), set()
+        for recorder in recorders:
+            recorder.close()
+
+    def cursor_update(self, tracker, recorder=None):
+        """Message con trỏ nếu vị trí/hình dạng đã đổi, gửi lại mỗi giây cho viewer mới; ngược lại None"""
+        state = tracker.poll()
+        now = time.monotonic()
+        if state == self.cursor_state and now - self.cursor_sent_at < 1.0:
+            return None
+        self.cursor_state = state
+        self.cursor_sent_at = now
+        self.cursor_id = (self.cursor_id + 1) & 0xFFFFFFFF
+        data = pack_cursor(self.cursor_id, *state, time.time())
+        if recorder:
+            recorder.write(data, frame=False)
+        return data
+
+    def cursor_loop(self, publish, stop_event, recorder=None):
+        """Thread gửi con trỏ chuột của host, tách khỏi đường capture/encode frame"""
+        try:
+            tracker = self.cursor_factory()
+        except Exception as e:
+            logger.warning(f"Không theo dõi được con trỏ chuột: {e}")
+            return
+        self.cursor_state = None
+        while not stop_event.is_set():
+            try:
+                data = self.cursor_update(tracker, recorder)
+                if data is not None:
+                    publish(data)
+            except Exception as e:
+                logger.error(f"Lỗi đọc con trỏ chuột: {e}")
+            stop_event.wait(self.cursor_interval)
+
     def image_deserializer(self, image_string):
         try:
             return Image.open(BytesIO(base64.b64decode(image_string)))
@@ -65,14 +317,20 @@ class VNC:
 
     # ---------------- Socket helpers ----------------
 
-    def send_msg(self, sock, msg):
+    def send_msg(self, sock, msg, session):
         try:
-            encrypt = chacha20_util.encrypt(self.password, self.nonce, msg)
-            data = struct.pack('>I', len(encrypt)) + encrypt
-            sock.sendall(data)
+            # Tách thời gian mã hoá và gửi; vẫn giữ send_lock như CipherSession.send
+            with session.send_lock:
+                started = time.perf_counter()
+                sealed = session.sender.seal(msg)
+                encrypted = time.perf_counter()
+                sock.sendall(sealed)
+            metrics.record('encrypt', encrypted - started, len(msg))
+            metrics.record('send', time.perf_counter() - encrypted, len(sealed))
             logger.debug(f"Đã gửi message ({len(msg)} bytes)")
         except (BrokenPipeError, ConnectionResetError) as e:
             logger.warning(f"Client ngắt kết nối: {e}")
+            raise
         except OSError as e:
             if e.errno == 10054:
                 logger.warning("Client đã đóng kết nối (WinError 10054)")
@@ -87,110 +345,152 @@ class VNC:
             logger.error(f"Lỗi send_msg: {e}")
             raise
 
-    def recv_msg(self, sock):
+    def recv_msg(self, reader):
         try:
-            raw_msglen = self.recvall(sock, 4)
-            if not raw_msglen:
+            started = time.perf_counter()
+            encrypted_data = reader.read_message()
+            if encrypted_data is None:
                 return None
-            msglen = struct.unpack('>I', raw_msglen)[0]
-            encrypted_data = self.recvall(sock, msglen)
-            decrypt = chacha20_util.decrypt(self.requestPassword, self.requestNonce, encrypted_data)
-            return decrypt
+            # receive gồm cả thời gian chờ host gửi frame
+            received = time.perf_counter()
+            metrics.record('receive', received - started, len(encrypted_data))
+            data = self.session.decrypt(encrypted_data)
+            metrics.record('decrypt', time.perf_counter() - received, len(data))
+            return data
         except Exception as e:
             logger.error(f"Lỗi recv_msg: {e}")
             return None
 
     def recvall(self, sock, n):
-        data = b''
-        while len(data) < n:
-            packet = sock.recv(n - len(data))
-            if not packet:
-                return None
-            data += packet
-        return data
+        return framing.recvall(sock, n)
 
     # ---------------- Network roles ----------------
 
-    def transmit(self, stop_event):
-        """Server gửi màn hình liên tục cho client"""
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as listener:
+    def authenticate(self, conn, viewers=0):
+        """Xác thực mật khẩu client gửi lên, trả về CipherSession nếu client được nhận"""
+        try:
+            salt = self.recvall(conn, chacha20_util.SALT_SIZE)
+            raw_msglen = self.recvall(conn, 4)
+            if not raw_msglen:
+                logger.warning("Client ngắt kêt nối khi đang xác thực")
+                return None
+            msglen = struct.unpack('>I', raw_msglen)[0]
+            password_data = self.recvall(conn, msglen)
+            if not password_data:
+                logger.warning("Không nhận được mật khâu từ client")
+            client_password = password_data.decode('utf-8')
+            if client_password != self.password:
+                logger.warning("Mật khẩu không đúng")
+                try:
+                    conn.sendall(b"AUTH_FAILED")
+                except:
+                    pass
+                return None
+            if viewers >= self.max_viewers:
+                logger.warning(f"Đã đủ {self.max_viewers} viewer, từ chối client mới")
+                try:
+                    conn.sendall(b"AUTH_BUSY")
+                except:
+                    pass
+                return None
+            nonce_bytes = self.nonce.encode('utf-8')
+            conn.sendall(b"AUTH_SUCCESS " + nonce_bytes)
+            return chacha20_util.CipherSession(self.password, self.nonce, salt, initiator=False)
+        except Exception as e:
+            logger.warning(f"Lỗi mật khẩu: {e}")
+            return None
+
+    def transmit(self, stop_event, listener=None):
+        """Server chụp và mã hoá màn hình một lần, gửi tới mọi viewer đã xác thực
+
+        listener có thể là ChannelListener của mux thay cho socket lắng nghe riêng.
+        """
+        try:
+            listener = listener or framing.open_listener(self.ip, self.port)
+            logger.info(f"VNC server đang chạy tại {self.ip}:{self.port}, chờ client...")
+        except Exception as e:
+            logger.error(f"Lỗi khi bind/listen VNC server: {e}")
+            return
+
+        with listener:
+            broadcaster = Broadcaster(self.send_frame, self.tile_encoder.request_keyframe, controller=self.bitrate)
+            session_stop = Event()
+            pipeline_thread = None
             try:
-                listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-                listener.bind((self.ip, self.port))
-                listener.listen()
-                listener.settimeout(0.5)
-                logger.info(f"VNC server đang chạy tại {self.ip}:{self.port}, chờ client...")
-                conn = None
-                addr = None
                 while not stop_event.is_set():
                     try:
                         conn, addr = listener.accept()
-                        break 
                     except socket.timeout:
                         continue
                     except Exception as e:
                         logger.error(f"Lỗi accept: {e}")
                         return
 
-                if stop_event.is_set():
-                    logger.info("receive_input thread stopped before client connected.")
-                    return
+                    conn.settimeout(self.auth_timeout)
+                    session = self.authenticate(conn, len(broadcaster))
+                    if session is None:
+                        conn.close()
+                        continue
+                    conn.settimeout(None)
+                    # Kênh video của kết nối mux: host bắt đầu nhận input/chat của kết nối này
+                    mark_authenticated = getattr(conn, 'mark_authenticated', None)
+                    if mark_authenticated:
+                        mark_authenticated()
 
-                if conn is None:
-                    logger.warning("Không thể thiết lập kết nối với input client.")
-                    return
+                    logger.info(f"VNC client đã kết nối: {addr}")
 
-            except Exception as e:
-                logger.error(f"Lỗi khi bind/listen VNC server: {e}")
-                return
+                    if broadcaster.join(conn, addr, session):
+                        continue
 
-            with conn:
-                try:
-                    raw_msglen = self.recvall(conn, 4)
-                    if not raw_msglen:
-                        logger.warning("Client ngắt kêt nối khi đang xác thực")
-                        return
-                    msglen = struct.unpack('>I', raw_msglen)[0]
-                    password_data = self.recvall(conn, msglen)
-                    if not password_data:
-                        logger.warning("Không nhận được mật khâu từ client")
-                    client_password = password_data.decode('utf-8')
-                    if client_password != self.password:
-                        logger.warning("Mật khẩu không đúng")
-                        try:
-                            conn.sendall(b"AUTH_FAILED")
-                        except:
-                            pass
-                        return
-                    else:
-                        nonce_bytes = self.nonce.encode('utf-8')
-                        conn.sendall(b"AUTH_SUCCESS " + nonce_bytes)
-                except Exception as e:
-                    logger.warning(f"Lỗi mật khẩu: {e}")
-                    return
+                    # Viewer đầu tiên => bắt đầu phiên mới
+                    if pipeline_thread:
+                        pipeline_thread.join()
 
-                logger.info(f"VNC client đã kết nối: {addr}")
+                    # Mở cửa sổ chat
+                    if self.open_chat_window:
+                        self.open_chat_window(addr[0])
 
-                # Mở cửa sổ chat
-                if self.open_chat_window:
-                    self.open_chat_window(addr[0])
+                    self.tile_encoder.reset()
+                    self.bitrate.reset()
+                    session_stop = Event()
+                    broadcaster.on_empty = session_stop.set
+                    broadcaster.add(conn, addr, session)
+                    pipeline_thread = Thread(target=self.run_session, args=[broadcaster, session_stop], daemon=True)
+                    pipeline_thread.start()
+            finally:
+                session_stop.set()
+                broadcaster.close()
+                if pipeline_thread:
+                    pipeline_thread.join(timeout=1)
 
-                while not stop_event.is_set():
-                    try:
-                        frame = self.image_serializer()
-                        if frame is None:
-                            continue
-                        self.send_msg(conn, frame)
-                        logger.debug("Đã gửi frame VNC")
-                    except Exception as e:
-                        logger.error(f"Lỗi vòng lặp transmit: {e}")
-                        if self.disconnect_chat:
-                            self.disconnect_chat()
-                        break
+    def run_session(self, broadcaster, session_stop):
+        recorder = self.open_recorder()
+        pipeline = FramePipeline(
+            self.source_factory(),
+            lambda image: self.encode_frame(image, recorder),
+            broadcaster.publish,
+            session_stop,
+            max_fps=self.max_fps,
+            controller=self.bitrate,
+        )
+        if self.cursor_factory:
+            Thread(target=self.cursor_loop, args=[broadcaster.publish, session_stop, recorder], daemon=True).start()
+        try:
+            pipeline.run()
+        except Exception as e:
+            logger.error(f"Lỗi vòng lặp transmit: {e}")
+        broadcaster.close()
+        self.close_recorder(recorder)
+        if self.disconnect_chat:
+            self.disconnect_chat()
+
+    def send_frame(self, conn, frame, session):
+        self.send_msg(conn, frame, session)
+        logger.debug("Đã gửi frame VNC")
 
-    def transmit_loop(self, stop_event):
+    def transmit_loop(self, stop_event, listener=None):
         while not stop_event.is_set():
-            self.transmit(stop_event)
+            self.transmit(stop_event, listener)
 
     def stop_receive(self):
         try:
@@ -198,23 +498,32 @@ class VNC:
         except Exception as e:
             logger.error(f"Lỗi đóng kết nối: {e}")
 
-    def start_receive(self, password):
-        """Client khởi động kết nối tới host"""
+    def start_receive(self, password, sock=None):
+        """Client khởi động kết nối tới host (sock: kênh mux đã kết nối sẵn nếu có)"""
         try:
-            self.conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.conn.connect((self.ip, self.port))
+            if sock is None:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                sock.connect((self.ip, self.port))
+            self.conn = sock
+            # Salt ngẫu nhiên cho mỗi kết nối => keystream không bao giờ lặp lại giữa các phiên
+            salt = chacha20_util.new_salt()
             password_bytes = password.encode('utf-8')
             raw_password = struct.pack('>I', len(password_bytes)) + password_bytes
-            self.conn.sendall(raw_password)
+            self.conn.sendall(salt + raw_password)
             result = self.conn.recv(1024)
             if b"AUTH_SUCCESS" in result:
                 self.requestPassword = password
                 self.requestNonce = result.split(b' ')[1].decode('utf-8')
+                self.session = chacha20_util.CipherSession(password, self.requestNonce, salt, initiator=True)
+                self.reader = framing.FramedReader(self.conn)
                 logger.info(f"VNC client đã kết nối tới host {self.ip}:{self.port}")
                 logger.debug(f"Receive password={self.requestPassword} nonce={self.requestNonce}")
                 return True
             else:
-                logger.error("Xác thực thất bại — mật khẩu sai")
+                if b"AUTH_BUSY" in result:
+                    logger.error("Host đã đủ số viewer")
+                else:
+                    logger.error("Xác thực thất bại — mật khẩu sai")
                 self.conn.close()
                 self.conn = None
                 return False
@@ -224,10 +533,13 @@ class VNC:
     def receive(self):
         """Client nhận frame từ host"""
         try:
-            data_string = self.recv_msg(self.conn)
+            data_string = self.recv_msg(self.reader)
             if data_string:
                 logger.debug(f"Đã nhận frame ({len(data_string)} bytes)")
-                return data_string.decode()
+                started = time.perf_counter()
+                frame = unpack_frame(data_string)
+                metrics.record('decode', time.perf_counter() - started, len(data_string))
+                return frame
             else:
                 logger.warning("Mất kết nối VNC hoặc frame rỗng")
                 return None